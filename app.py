@@ -1,43 +1,63 @@
 import os
 import time
-import json
 import asyncio
-from sqlmodel import SQLModel, create_engine, Session, select, text, update
+from sqlmodel import SQLModel
 from utils import jalali
-from collections import defaultdict
 from utils.assets import (
     CHINESE_SIGNS,
     CHINESE_ELEMENTS,
-    PERSIAN_MONTHS,
     CHINESE_SIGNS_FARSI,
-    CHINESE_ELEMENTS_FARSI,
     dashboard_keyboard,
-    is_user_member,
     is_valid_date,
     user_channel_check,
     insert_to_user_table,
     insert_to_kua_table,
     insert_to_zodiac_table,
-    insert_to_mashhad_table,
     insert_to_fengshui_test_table,
     insert_to_fengshui_score_table,
+    insert_to_channel_member_table,
     extract_chinese_year,
     calculate_kua_number,
     calculate_zodiac_animal,
-    send_join_channel_button,
+    check_lookup_tables,
+    get_kua_element,
+    get_zodiac_description,
     forward_message_to_users,
+    select_broadcast_recipients,
+    get_given_names,
     decade_buttons,
     year_buttons,
     month_buttons,
     day_buttons,
     gender_buttons,
     check_visit_count,
-    check_register
+    get_user,
+    reset_visit_counts,
+    set_quota_windows,
+    pop_waiting_reply_users,
 )
-from models import User, Kua, Zodiac, Mashhad, UserReplyState
+from utils.webhook import run_webhook
+from utils.database import run_db, create_database_engine, check_database_settings, rename_tables, add_missing_columns
+from utils.membership import MEMBER_STATUSES, membership_cache
+from utils.city_index import create_city_index
+from utils.stats import create_stats_triggers, rebuild_stats, get_stat, get_stats
+from utils.media import media_registry
+from utils.state import StateStore, SqliteStateBackend, MemoryStateBackend
+from utils.router import StateRouter
+from utils.callbacks import callback_router, get_or_create_secret
+from utils.executor import OrderedAsyncTeleBot
+from utils.supervisor import Supervisor, run_polling_supervisor, run_worker, ignore_shutdown_signals
+from utils.write_behind import WriteBehindBuffer
+from utils.export import EXPORT_TABLES, EXPORT_FORMATS, export_table
+from utils.segments import create_segment_indexes, is_segment_token, parse_segment, resolve_segment, select_segment_members
+from utils.broadcast import (
+    create_broadcast_job,
+    get_unfinished_broadcast_jobs,
+    run_broadcast_job,
+    progress_reporter,
+)
+from models import Kua, Zodiac, Mashhad, SegmentMember, ConversationState
 from dotenv import load_dotenv
-from telebot import apihelper
-from telebot.async_telebot import AsyncTeleBot
 from telebot.types import (
     BotCommand,
     InlineKeyboardMarkup,
@@ -45,7 +65,7 @@ from telebot.types import (
     KeyboardButton,
     ReplyKeyboardMarkup,
     ReplyKeyboardRemove,
-    CallbackQuery,
+    ReplyParameters,
 )
 
 
@@ -58,36 +78,65 @@ from telebot.types import (
 load_dotenv()
 
 # Temporary Storage For User Input Data
-user_data = {}
 user_mashhad_data = {}
-user_kua_data = {}
-user_zodiac_data = {}
+
+# Conversation State Backend ("sqlite" Keeps Flows Across Restarts, Or "memory")
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite")
 
 # Your Channel Username
 # CHANNELS = ["helekhobmalkhob", "aliravanbakhsh1"]
 CHANNELS = ["helekhobmalkhob"]
 # CHANNELS = ["HydroCodeChannel"]
 
+# Admins Allowed To Broadcast
+ADMIN_IDS = [7690029281, 52260445, 917104518]
+
+# Keep References To Running Broadcasts
+background_tasks = set()
+running_broadcasts = set()
+
+# Broadcasts Are Sent By One Process Only (Worker 0 With WORKERS > 1), So The
+# Telegram Rate Limit Is Shared. Other Workers Only Create The Jobs.
+runs_broadcasts = True
+BROADCAST_POLL_INTERVAL = 5
+
 # Maximum Visit
 MAX_VISIT = 0
 MAX_CALCULATION = 4
 
-TEXT_KUA_MAX_VISIT = "تعداد محاسبات عدد شانس شما به پایان رسیده است. برای محاسبه عدد شانس با یک شماره جدید وارد بات شوید!"
-TEXT_ZODIAC_MAX_VISIT = "تعداد محاسبات زودیاک تولد شما به پایان رسیده است. برای محاسبه زودیاک تولد با یک شماره جدید وارد بات شوید!"
+# Calendar Window Per Feature For MAX_CALCULATION ("day", "week", "month" Or None)
+QUOTA_WINDOWS = {Kua: None, Zodiac: None}
+
+# Tables Created Under An Explicit Name Before Every Model Used The Default One
+RENAMED_TABLES = {
+    "segment_member": SegmentMember.__tablename__,
+    "conversation_state": ConversationState.__tablename__,
+}
+
+# Update Ingestion (Webhook Mode Is Enabled When WEBHOOK_URL Is Set)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Unregister The Webhook On Shutdown (Off For Rolling Deploys)
+WEBHOOK_REMOVE_ON_SHUTDOWN = os.getenv("WEBHOOK_REMOVE_ON_SHUTDOWN", "0") == "1"
+ALLOWED_UPDATES = ["message", "callback_query", "chat_member"]
 
+# Updates Handled At Once (Each User's Updates Still Run One At A Time)
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "100"))
 
+# Worker Processes, Updates Are Sharded By Chat (More Than 1 Needs STATE_BACKEND=sqlite)
+WORKERS = int(os.getenv("WORKERS", "1"))
 
-with open('utils/zodiac.json', 'r', encoding='utf-8') as file:
-    zodiac_data = json.load(file)
+TEXT_KUA_MAX_VISIT = "تعداد محاسبات عدد شانس شما به پایان رسیده است. برای محاسبه عدد شانس با یک شماره جدید وارد بات شوید!"
+TEXT_ZODIAC_MAX_VISIT = "تعداد محاسبات زودیاک تولد شما به پایان رسیده است. برای محاسبه زودیاک تولد با یک شماره جدید وارد بات شوید!"
+TEXT_EXPIRED_BUTTON = "این دکمه منقضی شده است. لطفا دوباره از /start شروع کنید."
 
-with open('utils/kua.json', 'r', encoding='utf-8') as file:
-    kua_data = json.load(file)
 
-with open('utils/zodiac_animal_dataset.json', 'r', encoding='utf-8') as file:
-    zodiac_animal_dataset = json.load(file)
 
-with open('utils/kua_elements.json', 'r', encoding='utf-8') as file:
-    kua_element = json.load(file)
+# Compiled From utils/*.json By utils/build_lookup_tables.py
+check_lookup_tables()
 
 
 
@@ -96,8 +145,9 @@ with open('utils/kua_elements.json', 'r', encoding='utf-8') as file:
 # ------------------------------------------------------------------------------
 
 # Create Bot
-bot = AsyncTeleBot(
-    token=os.getenv("Bot_API_Token")
+bot = OrderedAsyncTeleBot(
+    token=os.getenv("Bot_API_Token"),
+    max_concurrency=UPDATE_CONCURRENCY
 )
 
 
@@ -106,8 +156,52 @@ bot = AsyncTeleBot(
 # Database
 # ------------------------------------------------------------------------------
 DATABASE_NAME = 'database.db'
-engine = create_engine(f"sqlite:///{DATABASE_NAME}", pool_size=500, max_overflow=500)
-SQLModel.metadata.create_all(engine)
+engine = create_database_engine(DATABASE_NAME)
+
+# Batched Commits For Per-User Writes
+write_buffer = WriteBehindBuffer(engine)
+
+# Conversation State
+state_backend = SqliteStateBackend(engine) if STATE_BACKEND == "sqlite" else MemoryStateBackend()
+user_data = StateStore("registration", state_backend)
+user_kua_data = StateStore("kua", state_backend, ttl=60 * 60)
+user_zodiac_data = StateStore("zodiac", state_backend, ttl=60 * 60)
+user_poll_state = StateStore("fengshui_test", state_backend)
+user_data_form = StateStore("fengshui_form", state_backend)
+user_input_state = StateStore("input", state_backend)
+STATE_STORES = [user_data, user_kua_data, user_zodiac_data, user_poll_state, user_data_form, user_input_state]
+
+# Text Messages Are Routed By The Sender's Input State
+text_router = StateRouter(user_input_state)
+
+
+def setup_database():
+    """One-time startup work, run by the main process before any worker is started.
+
+    Worker processes import this module again, they only build the engine,
+    bot and handlers and read what is set up here.
+    """
+    rename_tables(engine, RENAMED_TABLES)
+    SQLModel.metadata.create_all(engine)
+    add_missing_columns(engine, SQLModel.metadata)
+    create_city_index(engine)
+    create_stats_triggers(engine)
+    create_segment_indexes(engine)
+    set_quota_windows(engine, QUOTA_WINDOWS)
+    check_database_settings(engine)
+    media_registry.sync(engine)
+    load_callback_secret()
+
+    state_backend.purge_expired(time.time())
+    for store in STATE_STORES:
+        store.load()
+    for user_id in pop_waiting_reply_users(engine):
+        text_router.set(user_id, "awaiting_reply")
+
+
+def load_callback_secret():
+    # Signing Key For Inline Button Payloads (Generated And Stored Unless CALLBACK_SECRET Is Set)
+    callback_router.set_secret(os.getenv("CALLBACK_SECRET") or get_or_create_secret(engine))
 
 
 
@@ -118,9 +212,7 @@ SQLModel.metadata.create_all(engine)
 @bot.message_handler(commands=['start'])
 async def start_command(message):
     user_id = message.chat.id
-    with Session(engine) as session:
-        statement = select(User).where(User.user_id == user_id)
-        existing_user = session.exec(statement).first()
+    existing_user = await write_buffer.read(user_id, get_user, engine=engine, user_id=user_id)
     if existing_user:
         markup = dashboard_keyboard()
         await bot.send_message(
@@ -132,7 +224,7 @@ async def start_command(message):
             reply_markup=markup
         )
     else:
-        user_data[message.chat.id] = "awaiting_phone"
+        await text_router.clear(message.chat.id)
         phone_button = KeyboardButton(
             text="👈🏻ارسال شماره 👉🏻", 
             request_contact=True
@@ -155,10 +247,8 @@ async def start_command(message):
 @bot.message_handler(content_types=['contact'])
 async def handle_contact(message):
     phone_number = message.contact.phone_number
-    user_data[message.chat.id] = {
-        "state": "awaiting_name",
-        "phone_number": phone_number
-    }
+    user_data.set(message.chat.id, {"phone_number": phone_number})
+    text_router.set(message.chat.id, "awaiting_name")
     await bot.send_message(
         chat_id=message.chat.id,
         text=f"سپاس از شما. لطفا اسم و فامیل خودت را به فارسی این زیر بنویس:",
@@ -166,22 +256,18 @@ async def handle_contact(message):
     )
 
 
-@bot.message_handler(func=lambda message: user_data.get(message.chat.id, {}).get("state") == "awaiting_name")
+@text_router.state("awaiting_name")
 async def handle_name(message):
     name = message.text
-    phone_number = user_data[message.chat.id]["phone_number"]    
-    user_data[message.chat.id] = {
-        "state": "awaiting_city",
-        "phone_number": phone_number,
-        "name": name,
-    }
+    await user_data.update(message.chat.id, name=name)
+    text_router.set(message.chat.id, "awaiting_city")
     await bot.send_message(
         chat_id=message.chat.id,
         text=f"بسیار عالی! آخرین سوال. {name} میشه بگی از کدوم شهر هستی؟",
     )
 
 
-@bot.message_handler(func=lambda message: user_data.get(message.chat.id, {}).get("state") == "awaiting_city")
+@text_router.state("awaiting_city")
 async def handle_city(message):
     user_id = message.chat.id
     first_name = message.chat.first_name
@@ -193,8 +279,9 @@ async def handle_city(message):
         username = message.chat.get('username', None)
     except:
         username = None
-    phone_number = user_data[message.chat.id]["phone_number"]
-    given_name = user_data[message.chat.id]["name"]
+    registration = await user_data.get(message.chat.id)
+    phone_number = registration["phone_number"]
+    given_name = registration["name"]
     city = message.text
     print("Start: ", user_id)
     print("First Name: ", first_name)
@@ -204,8 +291,9 @@ async def handle_city(message):
     print("Given Name: ", given_name)
     print("City: ", city)
     print("End: ", user_id)
-    insert_to_user_table(
-        engine=engine,
+    write_buffer.submit_background(
+        insert_to_user_table,
+        key=user_id,
         user_id=user_id,
         username=username,
         phone_number=phone_number,
@@ -214,7 +302,8 @@ async def handle_city(message):
         given_name=given_name,
         city=city
     )
-    del user_data[message.chat.id]
+    await user_data.pop(message.chat.id)
+    await text_router.clear(message.chat.id)
     markup = dashboard_keyboard()
     await bot.send_message(
         chat_id=message.chat.id,
@@ -226,7 +315,7 @@ async def handle_city(message):
 #                              Handle Dashboard Command
 # ------------------------------------------------------------------------------ #
 
-@bot.callback_query_handler(func=lambda call: call.data in ["mashhad_button", "kua_button", "zodiac_button", "help_button", "start_button", "fengshui_test_button"])
+@callback_router.literal("mashhad_button", "kua_button", "zodiac_button", "help_button", "start_button", "fengshui_test_button")
 async def handle_dashboard_callbacks(call):
     user_id=call.message.chat.id
     if call.data == "mashhad_button":
@@ -271,8 +360,9 @@ async def handle_dashboard_callbacks(call):
 
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "confirm_join")
+@callback_router.literal("confirm_join")
 async def handle_confirm_join(call):
+    membership_cache.invalidate(call.message.chat.id, CHANNELS)
     await bot.edit_message_reply_markup(
         chat_id=call.message.chat.id,
         message_id=call.message.message_id,
@@ -287,7 +377,8 @@ async def handle_confirm_join(call):
             message=call.message,
             user_id=call.message.chat.id,
             max_visit=MAX_VISIT,
-            channels=CHANNELS
+            channels=CHANNELS,
+            refresh=True
         ):
             markup = dashboard_keyboard()
             await bot.send_message(
@@ -297,6 +388,21 @@ async def handle_confirm_join(call):
             )
 
 
+# Requires the bot to be an admin of the channels to receive these updates
+@bot.chat_member_handler(func=lambda update: update.chat.username in CHANNELS)
+async def handle_channel_member_update(update):
+    user_id = update.new_chat_member.user.id
+    status = update.new_chat_member.status
+    await run_db(
+        insert_to_channel_member_table,
+        engine=engine,
+        user_id=user_id,
+        channel=update.chat.username,
+        status=status
+    )
+    membership_cache.set(user_id, update.chat.username, status in MEMBER_STATUSES)
+
+
 # ------------------------------------------------------------------------------ #
 #                              Handle /mashhad Command
 # ------------------------------------------------------------------------------ #
@@ -399,6 +505,19 @@ async def handle_confirm_join(call):
 #     )
 
 
+async def wizard_state(call, store, *fields):
+    """The user's date picker state if it has the fields, else answer the button as expired.
+
+    A state popped by a finished calculation (e.g. a double tap on the last
+    button) or expired by its TTL must not be restarted by update().
+    """
+    state = await store.get(call.message.chat.id)
+    if state is None or any(field not in state for field in fields):
+        await bot.answer_callback_query(callback_query_id=call.id, text=TEXT_EXPIRED_BUTTON)
+        return None
+    return state
+
+
 # ------------------------------------------------------------------------------ #
 #                              Handle /kua Command
 # ------------------------------------------------------------------------------ #
@@ -414,7 +533,9 @@ async def kua_command(message):
         max_visit=MAX_VISIT,
         channels=CHANNELS
     ):
-        if check_visit_count(
+        if await write_buffer.read(
+            user_id,
+            check_visit_count,
             engine=engine,
             table=Kua,
             user_id=user_id,
@@ -433,7 +554,7 @@ async def kua_command(message):
             await decade_buttons(
                 bot=bot,
                 chat_id=message.chat.id,
-                callback_prefix="kua_decade_"
+                feature="kua"
             )
         else:
             await bot.send_message(
@@ -444,8 +565,8 @@ async def kua_command(message):
             
         
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("kua_decade_"))
-async def kua_command_handle_decade_selection(call):
+@callback_router.route("kua", "decade")
+async def kua_command_handle_decade_selection(call, value):
     user_id = call.message.chat.id
     if await user_channel_check(
         engine=engine,
@@ -456,13 +577,15 @@ async def kua_command_handle_decade_selection(call):
         max_visit=MAX_VISIT,
         channels=CHANNELS
     ):
-        if check_visit_count(
+        if await write_buffer.read(
+            user_id,
+            check_visit_count,
             engine=engine,
             table=Kua,
             user_id=user_id,
             max_calculation=MAX_CALCULATION
         ):
-            selected_decade = call.data.split("_")[2]
+            selected_decade = value
             start_year = int(selected_decade)
             end_year = start_year + 9
             await year_buttons(
@@ -470,7 +593,8 @@ async def kua_command_handle_decade_selection(call):
                 chat_id=user_id,
                 start_year=start_year,
                 end_year=end_year,
-                callback_prefix="kua_year_"
+                feature="kua",
+                message_id=call.message.message_id
             )
             await bot.answer_callback_query(callback_query_id=call.id)
         else:
@@ -478,10 +602,13 @@ async def kua_command_handle_decade_selection(call):
                 chat_id=user_id,
                 text=TEXT_KUA_MAX_VISIT
             )
+            await bot.answer_callback_query(callback_query_id=call.id)
+    else:
+        await bot.answer_callback_query(callback_query_id=call.id)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("kua_year_"))
-async def kua_command_handle_year_selection(call):
+@callback_router.route("kua", "year")
+async def kua_command_handle_year_selection(call, value):
     user_id = call.message.chat.id
     if await user_channel_check(
         engine=engine,
@@ -492,29 +619,35 @@ async def kua_command_handle_year_selection(call):
         max_visit=MAX_VISIT,
         channels=CHANNELS
     ):
-        if check_visit_count(
+        if await write_buffer.read(
+            user_id,
+            check_visit_count,
             engine=engine,
             table=Kua,
             user_id=user_id,
             max_calculation=MAX_CALCULATION
         ):
-            birth_year = int(call.data.split("_")[2])
-            user_kua_data[user_id] = {"birth_year": birth_year }
+            birth_year = int(value)
+            user_kua_data.set(user_id, {"birth_year": birth_year})
             await month_buttons(
-                bot=bot, 
+                bot=bot,
                 chat_id=user_id,
-                callback_prefix="kua_month_"
-                )
+                feature="kua",
+                message_id=call.message.message_id
+            )
             await bot.answer_callback_query(callback_query_id=call.id)
         else:
             await bot.send_message(
                 chat_id=user_id,
                 text=TEXT_KUA_MAX_VISIT
             )
+            await bot.answer_callback_query(callback_query_id=call.id)
+    else:
+        await bot.answer_callback_query(callback_query_id=call.id)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("kua_month_"))
-async def kua_command_handle_month_selection(call):
+@callback_router.route("kua", "month")
+async def kua_command_handle_month_selection(call, value):
     user_id = call.message.chat.id
     if await user_channel_check(
         engine=engine,
@@ -525,18 +658,25 @@ async def kua_command_handle_month_selection(call):
         max_visit=MAX_VISIT,
         channels=CHANNELS
     ):
-        if check_visit_count(
+        if await write_buffer.read(
+            user_id,
+            check_visit_count,
             engine=engine,
             table=Kua,
             user_id=user_id,
             max_calculation=MAX_CALCULATION
         ):
-            birth_month = int(call.data.split("_")[2])
-            user_kua_data[user_id]["birth_month"] = birth_month
+            if await wizard_state(call, user_kua_data, "birth_year") is None:
+                return
+            birth_month = int(value)
+            state = await user_kua_data.update(user_id, birth_month=birth_month)
             await day_buttons(
                 bot=bot,
                 chat_id=user_id,
-                callback_prefix="kua_day_"
+                year=state["birth_year"],
+                month=birth_month,
+                feature="kua",
+                message_id=call.message.message_id
             )
             await bot.answer_callback_query(callback_query_id=call.id)
         else:
@@ -544,9 +684,12 @@ async def kua_command_handle_month_selection(call):
                 chat_id=user_id,
                 text=TEXT_KUA_MAX_VISIT
             )
+            await bot.answer_callback_query(callback_query_id=call.id)
+    else:
+        await bot.answer_callback_query(callback_query_id=call.id)
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("kua_day_"))
-async def kua_command_handle_day_selection(call):
+@callback_router.route("kua", "day")
+async def kua_command_handle_day_selection(call, value):
     user_id = call.message.chat.id
     if await user_channel_check(
         engine=engine,
@@ -557,18 +700,23 @@ async def kua_command_handle_day_selection(call):
         max_visit=MAX_VISIT,
         channels=CHANNELS
     ):
-        if check_visit_count(
+        if await write_buffer.read(
+            user_id,
+            check_visit_count,
             engine=engine,
             table=Kua,
             user_id=user_id,
             max_calculation=MAX_CALCULATION
         ):
-            birth_day = int(call.data.split("_")[2])
-            user_kua_data[user_id]["birth_day"] = birth_day
+            if await wizard_state(call, user_kua_data, "birth_year", "birth_month") is None:
+                return
+            birth_day = int(value)
+            await user_kua_data.update(user_id, birth_day=birth_day)
             await gender_buttons(
                 bot=bot,
                 chat_id=user_id,
-                callback_prefix="kua_gender_"
+                feature="kua",
+                message_id=call.message.message_id
             )
             await bot.answer_callback_query(callback_query_id=call.id)
         else:
@@ -576,10 +724,13 @@ async def kua_command_handle_day_selection(call):
                 chat_id=user_id,
                 text=TEXT_KUA_MAX_VISIT
             )
+            await bot.answer_callback_query(callback_query_id=call.id)
+    else:
+        await bot.answer_callback_query(callback_query_id=call.id)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("kua_gender_"))
-async def kua_command_handle_gender_selection(call):
+@callback_router.route("kua", "gender")
+async def kua_command_handle_gender_selection(call, value):
     user_id = call.message.chat.id
     if await user_channel_check(
         engine=engine,
@@ -590,144 +741,137 @@ async def kua_command_handle_gender_selection(call):
         max_visit=MAX_VISIT,
         channels=CHANNELS
     ):
-        if check_visit_count(
-            engine=engine,
-            table=Kua,
-            user_id=user_id,
-            max_calculation=MAX_CALCULATION
-        ):
-            gender = call.data.split("_")[2]
-            user_kua_data[user_id]["gender"] = gender
-            birth_year = user_kua_data[user_id]["birth_year"]
-            birth_month = user_kua_data[user_id]["birth_month"]
-            birth_day = user_kua_data[user_id]["birth_day"]
-
-            if not is_valid_date(int(birth_year), int(birth_month), int(birth_day)):
-                await bot.send_message(
-                    chat_id=user_id, 
-                    text="تاریخ وارد شده اشتباه است. لطفا تاریخ را به صورت صحیح وارد کن!",
-                )
-                await decade_buttons(
-                        bot=bot,
-                        chat_id=user_id,
-                        callback_prefix="kua_decade_"
-                    )
-                return
-
-            birth_year_g, birth_month_g, birth_day_g = jalali.Persian((int(birth_year), int(birth_month), int(birth_day))).gregorian_tuple()
-            
-            # chinese_year = extract_chinese_year(
-            #     date_string=f"{birth_year_g:04d}-{birth_month_g:02d}-{birth_day_g:02d}"
-            # )
-
-            kua_number = calculate_kua_number(
-                kua_data=kua_data,
-                birth_year=birth_year_g,
-                gender=gender
-            )
-
-            await bot.send_message(
-                chat_id=user_id,
-                text=f"📝 اطلاعات دریافت‌ شده:\n- تاریخ تولد: {birth_year}/{birth_month}/{birth_day}\n- جنسیت: {'مرد' if gender == 'male' else 'زن'}"
-            )
-            
-            # # Send Kua Number Result
-            # file_path = os.path.abspath(f"./data/img/kua_number_{kua_number}.png")
-            # if not os.path.exists(file_path):
-            #     print("File not found:", file_path)
-            # else:
-            #     print("File founded:", file_path)
-            # with open(file_path, "rb") as photo:
-            #     print("File opened successfully", file_path)
-            #     await bot.send_photo(
-            #         chat_id=user_id,
-            #         photo=photo,
-            #         caption=f"عدد کوا شما «{kua_number}» می‌باشد!",
-            #     )  
-                    
-            # # Send Kua Number Result
-            # file_path_voice = os.path.abspath(f"./data/ویس_تکنیک_عدد_شانس.m4a")
-            # if not os.path.exists(file_path_voice):
-            #     print("File not found:", file_path_voice)
-            # else:
-            #     print("File founded:", file_path_voice)
-            # with open(file_path_voice, "rb") as voice:
-            #     print("File opened successfully", file_path_voice)
-            #     await bot.send_audio(
-            #         chat_id=user_id,
-            #         audio=voice,
-            #         caption=f"ویس تکنیک عدد شانس",
-            #         timeout=60
-            #     )         
-            # kn = str(kua_number)
-            # await bot.send_message(
-            #     chat_id=user_id,
-            #     text=(
-            #         "برای ثبت نام به آیدی زیر پیام بده:\n\n"
-            #         "@fereshtehelp\n"      
-            #         "👆👆👆👆\n"      
-            #     ),
-            #     parse_mode="HTML",
-            # )
-            
-                        
-            await bot.send_message(
-                chat_id=user_id,
-                text=(
-                    f"عدد کوا (شانس) شما {kua_number} میباشد.\n\n"
-                    f"عنصر شما {kua_element[str(kua_number)]["element"]} است."
-                ),
-                parse_mode="HTML",
-            )
-            
-            await bot.send_message(
+        if await wizard_state(call, user_kua_data, "birth_year", "birth_month", "birth_day") is None:
+            return
+        gender = value
+        kua_data = await user_kua_data.update(user_id, gender=gender)
+        birth_year = kua_data["birth_year"]
+        birth_month = kua_data["birth_month"]
+        birth_day = kua_data["birth_day"]
+
+        if not is_valid_date(int(birth_year), int(birth_month), int(birth_day)):
+            await decade_buttons(
+                bot=bot,
                 chat_id=user_id,
-                text=(
-                    "سلام 🌱\n"
-                    "خوشحالم که در مسیر نور و آگاهی قرار داری …\n\n"
-                    "همین الان وارد کانال زیر بشو  چون به رایگان بهت گفتم که با توجه به اطلاعاتی که بدست آوردی امسال چه انرژی هایی برات فعاله!!!\n\n"
-                    "🔹 به‌علاوه، یک پاکسازی ویژه «نگهبان نور» که  برای رفع دعا و طلسم و جادو و چشم زخم  و انرژی حسادت در سال ۲۰۲۶ باید حتما انجامش بدی چون تو رو دربرابر همه این خطر ها محافظت میکنه.\n\n"
-                    "اگه هنوز وارد کانال تلگرام نشدی و این آموزش‌ها رو نداری،👇\n"
-                    "همین الان روی لینک زیر بزن و وارد شو\n"
-                    "تا از این اطلاعات ارزشمند جا نمونی\n\n"
-                    "https://t.me/fereshte2026 \n\n"
-                    "سوالی هم داشتی از آیدی زیر بپرس 👇🏼\n"
-                    "@fereshtehelp"
-                ),
-                parse_mode="HTML",
+                feature="kua",
+                message_id=call.message.message_id,
+                text="تاریخ وارد شده اشتباه است. لطفاً دهه سال تولد خود را دوباره انتخاب کنید:"
             )
+            await bot.answer_callback_query(callback_query_id=call.id)
+            return
 
-            with Session(engine) as session:
-                statement = select(Kua).where(Kua.user_id == user_id)
-                user = session.exec(statement).first()
-                if user:
-                    count_visit = user.count_visit + 1
-                else:
-                    count_visit = 1
-                    
-            
-            insert_to_kua_table(
-                engine=engine,
-                user_id=user_id,
-                gender=gender,
-                birth_date=f"{birth_year:04d}-{birth_month:02d}-{birth_day:02d}",
-                kua_number=kua_number,
-                count_visit=count_visit
-            )
+        birth_year_g, birth_month_g, birth_day_g = jalali.Persian((int(birth_year), int(birth_month), int(birth_day))).gregorian_tuple()
+        
+        # chinese_year = extract_chinese_year(
+        #     date_string=f"{birth_year_g:04d}-{birth_month_g:02d}-{birth_day_g:02d}"
+        # )
 
-            user_kua_data.pop(user_id, None)
-            markup = dashboard_keyboard()
-            await bot.send_message(
-                chat_id=user_id,
-                text=f"اینجا چندتا گزینه وجود داره که میتونی انتخاب کنی:",
-                reply_markup=markup
-            )
-            await bot.answer_callback_query(callback_query_id=call.id)
-        else:
+        kua_number = calculate_kua_number(
+            birth_year=birth_year_g,
+            gender=gender
+        )
+
+        count_visit = await write_buffer.submit(
+            insert_to_kua_table,
+            key=user_id,
+            user_id=user_id,
+            gender=gender,
+            birth_date=f"{birth_year:04d}-{birth_month:02d}-{birth_day:02d}",
+            kua_number=kua_number,
+            max_calculation=MAX_CALCULATION
+        )
+        if count_visit is None:
             await bot.send_message(
                 chat_id=user_id,
                 text=TEXT_KUA_MAX_VISIT
             )
+            await bot.answer_callback_query(callback_query_id=call.id)
+            return
+
+        # The wizard message becomes the summary, which also drops its keyboard.
+        await bot.edit_message_text(
+            text=f"📝 اطلاعات دریافت‌ شده:\n- تاریخ تولد: {birth_year}/{birth_month}/{birth_day}\n- جنسیت: {'مرد' if gender == 'male' else 'زن'}",
+            chat_id=user_id,
+            message_id=call.message.message_id
+        )
+        
+        # # Send Kua Number Result
+        # file_path = os.path.abspath(f"./data/img/kua_number_{kua_number}.png")
+        # if not os.path.exists(file_path):
+        #     print("File not found:", file_path)
+        # else:
+        #     print("File founded:", file_path)
+        # with open(file_path, "rb") as photo:
+        #     print("File opened successfully", file_path)
+        #     await bot.send_photo(
+        #         chat_id=user_id,
+        #         photo=photo,
+        #         caption=f"عدد کوا شما «{kua_number}» می‌باشد!",
+        #     )  
+                
+        # # Send Kua Number Result
+        # file_path_voice = os.path.abspath(f"./data/ویس_تکنیک_عدد_شانس.m4a")
+        # if not os.path.exists(file_path_voice):
+        #     print("File not found:", file_path_voice)
+        # else:
+        #     print("File founded:", file_path_voice)
+        # with open(file_path_voice, "rb") as voice:
+        #     print("File opened successfully", file_path_voice)
+        #     await bot.send_audio(
+        #         chat_id=user_id,
+        #         audio=voice,
+        #         caption=f"ویس تکنیک عدد شانس",
+        #         timeout=60
+        #     )         
+        # kn = str(kua_number)
+        # await bot.send_message(
+        #     chat_id=user_id,
+        #     text=(
+        #         "برای ثبت نام به آیدی زیر پیام بده:\n\n"
+        #         "@fereshtehelp\n"      
+        #         "👆👆👆👆\n"      
+        #     ),
+        #     parse_mode="HTML",
+        # )
+        
+                    
+        await bot.send_message(
+            chat_id=user_id,
+            text=(
+                f"عدد کوا (شانس) شما {kua_number} میباشد.\n\n"
+                f"عنصر شما {get_kua_element(kua_number)} است."
+            ),
+            parse_mode="HTML",
+        )
+        
+        await bot.send_message(
+            chat_id=user_id,
+            text=(
+                "سلام 🌱\n"
+                "خوشحالم که در مسیر نور و آگاهی قرار داری …\n\n"
+                "همین الان وارد کانال زیر بشو  چون به رایگان بهت گفتم که با توجه به اطلاعاتی که بدست آوردی امسال چه انرژی هایی برات فعاله!!!\n\n"
+                "🔹 به‌علاوه، یک پاکسازی ویژه «نگهبان نور» که  برای رفع دعا و طلسم و جادو و چشم زخم  و انرژی حسادت در سال ۲۰۲۶ باید حتما انجامش بدی چون تو رو دربرابر همه این خطر ها محافظت میکنه.\n\n"
+                "اگه هنوز وارد کانال تلگرام نشدی و این آموزش‌ها رو نداری،👇\n"
+                "همین الان روی لینک زیر بزن و وارد شو\n"
+                "تا از این اطلاعات ارزشمند جا نمونی\n\n"
+                "https://t.me/fereshte2026 \n\n"
+                "سوالی هم داشتی از آیدی زیر بپرس 👇🏼\n"
+                "@fereshtehelp"
+            ),
+            parse_mode="HTML",
+        )
+
+
+        await user_kua_data.pop(user_id, None)
+        markup = dashboard_keyboard()
+        await bot.send_message(
+            chat_id=user_id,
+            text=f"اینجا چندتا گزینه وجود داره که میتونی انتخاب کنی:",
+            reply_markup=markup
+        )
+        await bot.answer_callback_query(callback_query_id=call.id)
+    else:
+        await bot.answer_callback_query(callback_query_id=call.id)
 
 
 # ------------------------------------------------------------------------------ #
@@ -746,7 +890,9 @@ async def zodiac_command(message):
         max_visit=MAX_VISIT,
         channels=CHANNELS
     ):
-        if check_visit_count(
+        if await write_buffer.read(
+            user_id,
+            check_visit_count,
             engine=engine,
             table=Zodiac,
             user_id=user_id,
@@ -763,7 +909,7 @@ async def zodiac_command(message):
             await decade_buttons(
                 bot=bot,
                 chat_id=user_id,
-                callback_prefix="zodiac_decade_"
+                feature="zodiac"
             )
         else:
             await bot.send_message(
@@ -772,8 +918,8 @@ async def zodiac_command(message):
             )
         
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("zodiac_decade_"))
-async def zodiac_command_handle_decade_selection(call):
+@callback_router.route("zodiac", "decade")
+async def zodiac_command_handle_decade_selection(call, value):
     user_id = call.message.chat.id
     if await user_channel_check(
         engine=engine,
@@ -784,13 +930,15 @@ async def zodiac_command_handle_decade_selection(call):
         max_visit=MAX_VISIT,
         channels=CHANNELS
     ):
-        if check_visit_count(
+        if await write_buffer.read(
+            user_id,
+            check_visit_count,
             engine=engine,
             table=Zodiac,
             user_id=user_id,
             max_calculation=MAX_CALCULATION
         ):
-            selected_decade = call.data.split("_")[2]
+            selected_decade = value
             start_year = int(selected_decade)
             end_year = start_year + 9
             await year_buttons(
@@ -798,7 +946,8 @@ async def zodiac_command_handle_decade_selection(call):
                 chat_id=user_id,
                 start_year=start_year,
                 end_year=end_year,
-                callback_prefix="zodiac_year_"
+                feature="zodiac",
+                message_id=call.message.message_id
             )
             await bot.answer_callback_query(callback_query_id=call.id)
         else:
@@ -806,10 +955,13 @@ async def zodiac_command_handle_decade_selection(call):
                 chat_id=user_id,
                 text=TEXT_ZODIAC_MAX_VISIT
             )
+            await bot.answer_callback_query(callback_query_id=call.id)
+    else:
+        await bot.answer_callback_query(callback_query_id=call.id)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("zodiac_year_"))
-async def zodiac_command_handle_year_selection(call):
+@callback_router.route("zodiac", "year")
+async def zodiac_command_handle_year_selection(call, value):
     user_id = call.message.chat.id
     if await user_channel_check(
         engine=engine,
@@ -820,29 +972,35 @@ async def zodiac_command_handle_year_selection(call):
         max_visit=MAX_VISIT,
         channels=CHANNELS
     ):
-        if check_visit_count(
+        if await write_buffer.read(
+            user_id,
+            check_visit_count,
             engine=engine,
             table=Zodiac,
             user_id=user_id,
             max_calculation=MAX_CALCULATION
         ):
-            birth_year = int(call.data.split("_")[2])
-            user_zodiac_data[user_id] = {"birth_year": birth_year }
+            birth_year = int(value)
+            user_zodiac_data.set(user_id, {"birth_year": birth_year})
             await month_buttons(
-                bot=bot, 
+                bot=bot,
                 chat_id=user_id,
-                callback_prefix="zodiac_month_"
-                )
+                feature="zodiac",
+                message_id=call.message.message_id
+            )
             await bot.answer_callback_query(callback_query_id=call.id)
         else:
             await bot.send_message(
                 chat_id=user_id,
                 text=TEXT_ZODIAC_MAX_VISIT
             )
+            await bot.answer_callback_query(callback_query_id=call.id)
+    else:
+        await bot.answer_callback_query(callback_query_id=call.id)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("zodiac_month_"))
-async def zodiac_command_handle_month_selection(call):
+@callback_router.route("zodiac", "month")
+async def zodiac_command_handle_month_selection(call, value):
     user_id = call.message.chat.id
     if await user_channel_check(
         engine=engine,
@@ -853,18 +1011,25 @@ async def zodiac_command_handle_month_selection(call):
         max_visit=MAX_VISIT,
         channels=CHANNELS
     ):
-        if check_visit_count(
+        if await write_buffer.read(
+            user_id,
+            check_visit_count,
             engine=engine,
             table=Zodiac,
             user_id=user_id,
             max_calculation=MAX_CALCULATION
         ):
-            birth_month = int(call.data.split("_")[2])
-            user_zodiac_data[user_id]["birth_month"] = birth_month
+            if await wizard_state(call, user_zodiac_data, "birth_year") is None:
+                return
+            birth_month = int(value)
+            state = await user_zodiac_data.update(user_id, birth_month=birth_month)
             await day_buttons(
                 bot=bot,
                 chat_id=user_id,
-                callback_prefix="zodiac_day_"
+                year=state["birth_year"],
+                month=birth_month,
+                feature="zodiac",
+                message_id=call.message.message_id
             )
             await bot.answer_callback_query(callback_query_id=call.id)
         else:
@@ -872,10 +1037,13 @@ async def zodiac_command_handle_month_selection(call):
                 chat_id=user_id,
                 text=TEXT_ZODIAC_MAX_VISIT
             )
+            await bot.answer_callback_query(callback_query_id=call.id)
+    else:
+        await bot.answer_callback_query(callback_query_id=call.id)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("zodiac_day_"))
-async def zodiac_command_handle_day_selection(call):
+@callback_router.route("zodiac", "day")
+async def zodiac_command_handle_day_selection(call, value):
     user_id = call.message.chat.id
     if await user_channel_check(
         engine=engine,
@@ -886,190 +1054,362 @@ async def zodiac_command_handle_day_selection(call):
         max_visit=MAX_VISIT,
         channels=CHANNELS
     ):
-        if check_visit_count(
-            engine=engine,
-            table=Zodiac,
-            user_id=user_id,
-            max_calculation=MAX_CALCULATION
-        ):
-            birth_day = int(call.data.split("_")[2])
-            user_zodiac_data[user_id]["birth_day"] = birth_day
+        if await wizard_state(call, user_zodiac_data, "birth_year", "birth_month") is None:
+            return
+        birth_day = int(value)
+        zodiac_data = await user_zodiac_data.update(user_id, birth_day=birth_day)
 
-            birth_year = user_zodiac_data[user_id]["birth_year"]
-            birth_month = user_zodiac_data[user_id]["birth_month"]
-            birth_day = user_zodiac_data[user_id]["birth_day"]
+        birth_year = zodiac_data["birth_year"]
+        birth_month = zodiac_data["birth_month"]
+        birth_day = zodiac_data["birth_day"]
 
-            if not is_valid_date(int(birth_year), int(birth_month), int(birth_day)):
-                await bot.send_message(
-                    chat_id=user_id, 
-                    text="تاریخ وارد شده اشتباه است. لطفا تاریخ را به صورت صحیح وارد کن!",
-                )
-                await decade_buttons(
-                        bot=bot,
-                        chat_id=user_id,
-                        callback_prefix="zodiac_decade_"
-                    )
-                return
-
-            await bot.send_message(
+        if not is_valid_date(int(birth_year), int(birth_month), int(birth_day)):
+            await decade_buttons(
+                bot=bot,
                 chat_id=user_id,
-                text=f"📝 اطلاعات دریافت‌ شده:\n- تاریخ تولد: {birth_year}/{birth_month}/{birth_day}"
-            )
-            
-            birth_year_g, birth_month_g, birth_day_g = jalali.Persian((int(birth_year), int(birth_month), int(birth_day))).gregorian_tuple()
-            
-            chinese_year = extract_chinese_year(
-                date_string=f"{birth_year_g:04d}-{birth_month_g:02d}-{birth_day_g:02d}"
+                feature="zodiac",
+                message_id=call.message.message_id,
+                text="تاریخ وارد شده اشتباه است. لطفاً دهه سال تولد خود را دوباره انتخاب کنید:"
             )
-            
-            chinese_sign_eng = calculate_zodiac_animal(
-                zodiac_animal_dataset=zodiac_animal_dataset,
-                birth_year=birth_year_g,
-            )
-            
-            chinese_sign = CHINESE_SIGNS[int(chinese_year % 12)]
-            
-            
-            chinese_element = CHINESE_ELEMENTS[int(chinese_year % 10) // 2]
-            
-            file_path = os.path.abspath(f"./data/img/zodiac_{chinese_sign_eng}.png")
-            if not os.path.exists(file_path):
-                print("File not found:", file_path)
-            else:
-                print("File founded:", file_path)
-            with open(file_path, "rb") as photo:
-                print("File opened successfully", file_path)
-                await bot.send_photo(
-                    chat_id=user_id,
-                    photo=photo,
-                    caption=f"زودیاک تولد شما «{CHINESE_SIGNS_FARSI[chinese_sign_eng]}» می‌باشد!",
-                )
-
+            await bot.answer_callback_query(callback_query_id=call.id)
+            return
 
+        birth_year_g, birth_month_g, birth_day_g = jalali.Persian((int(birth_year), int(birth_month), int(birth_day))).gregorian_tuple()
+        
+        chinese_year = extract_chinese_year(
+            year=birth_year_g,
+            month=birth_month_g,
+            day=birth_day_g
+        )
+        
+        chinese_sign_eng = calculate_zodiac_animal(
+            birth_year=birth_year_g,
+        )
+        
+        chinese_sign = CHINESE_SIGNS[int(chinese_year % 12)]
+        
+        
+        chinese_element = CHINESE_ELEMENTS[int(chinese_year % 10) // 2]
+        
+        count_visit = await write_buffer.submit(
+            insert_to_zodiac_table,
+            key=user_id,
+            user_id=user_id,
+            birth_date=f"{birth_year:04d}-{birth_month:02d}-{birth_day:02d}",
+            chinese_sign=chinese_sign,
+            chinese_element=chinese_element,
+            max_calculation=MAX_CALCULATION
+        )
+        if count_visit is None:
             await bot.send_message(
                 chat_id=user_id,
-                text=(
-                    f"{zodiac_data[chinese_sign_eng]["description"]}\n\n"
-                    # f"عددهای شانس شما: {zodiac_data[chinese_sign]["lucky_numbers"]}\n\n"
-                    # f"رنگ‌های شانس شما: {zodiac_data[chinese_sign]["lucky_colors"]}\n\n"
-                )
+                text=TEXT_ZODIAC_MAX_VISIT
             )
+            await bot.answer_callback_query(callback_query_id=call.id)
+            return
 
-            #         # Send Kua Number Result
-            # file_path_voice = os.path.abspath(f"./data/ویس_تکنیک_عدد_شانس.m4a")
-            # if not os.path.exists(file_path_voice):
-            #     print("File not found:", file_path_voice)
-            # else:
-            #     print("File founded:", file_path_voice)
-            # with open(file_path_voice, "rb") as voice:
-            #     print("File opened successfully", file_path_voice)
-            #     await bot.send_audio(
-            #         chat_id=user_id,
-            #         audio=voice,
-            #         caption=f"ویس تکنیک عدد شانس",
-            #         timeout=60
-            #     )
+        # The wizard message becomes the summary, which also drops its keyboard.
+        await bot.edit_message_text(
+            text=f"📝 اطلاعات دریافت‌ شده:\n- تاریخ تولد: {birth_year}/{birth_month}/{birth_day}",
+            chat_id=user_id,
+            message_id=call.message.message_id
+        )
 
+        await media_registry.send(
+            bot=bot,
+            engine=engine,
+            chat_id=user_id,
+            path=f"img/zodiac_{chinese_sign_eng}.png",
+            caption=f"زودیاک تولد شما «{CHINESE_SIGNS_FARSI[chinese_sign_eng]}» می‌باشد!",
+        )
 
-            await bot.send_message(
-                chat_id=user_id,
-                text=(
-                    "سلام 🌱\n"
-                    "خوشحالم که در مسیر نور و آگاهی قرار داری …\n\n"
-                    "همین الان وارد کانال زیر بشو  چون به رایگان بهت گفتم که با توجه به اطلاعاتی که بدست آوردی امسال چه انرژی هایی برات فعاله!!!\n\n"
-                    "🔹 به‌علاوه، یک پاکسازی ویژه «نگهبان نور» که  برای رفع دعا و طلسم و جادو و چشم زخم  و انرژی حسادت در سال ۲۰۲۶ باید حتما انجامش بدی چون تو رو دربرابر همه این خطر ها محافظت میکنه.\n\n"
-                    "اگه هنوز وارد کانال تلگرام نشدی و این آموزش‌ها رو نداری،👇\n"
-                    "همین الان روی لینک زیر بزن و وارد شو\n"
-                    "تا از این اطلاعات ارزشمند جا نمونی\n\n"
-                    "https://t.me/fereshte2026\n\n"
-                    "سوالی هم داشتی از آیدی زیر بپرس 👇🏼\n"
-                    "@fereshtehelp"
-                ),
-                parse_mode="HTML",
-            )    
-            
 
-            with Session(engine) as session:
-                statement = select(Zodiac).where(Zodiac.user_id == user_id)
-                user = session.exec(statement).first()
-                if user:
-                    count_visit = user.count_visit + 1
-                else:
-                    count_visit = 1
-                    
-            
-            insert_to_zodiac_table(
-                engine=engine,
-                user_id=user_id,
-                birth_date=f"{birth_year:04d}-{birth_month:02d}-{birth_day:02d}",
-                chinese_sign=chinese_sign,
-                chinese_element=chinese_element,
-                count_visit=count_visit
+        await bot.send_message(
+            chat_id=user_id,
+            text=(
+                f"{get_zodiac_description(chinese_sign_eng)}\n\n"
+                # f"عددهای شانس شما: {zodiac_data[chinese_sign]["lucky_numbers"]}\n\n"
+                # f"رنگ‌های شانس شما: {zodiac_data[chinese_sign]["lucky_colors"]}\n\n"
             )
+        )
 
-            user_zodiac_data.pop(user_id, None)
-            markup = dashboard_keyboard()
-            await bot.send_message(
-                chat_id=user_id,
-                text=f"اینجا چندتا گزینه وجود داره که میتونی انتخاب کنی:",
-                reply_markup=markup
-            )
-            await bot.answer_callback_query(callback_query_id=call.id)
-        else:
-            await bot.send_message(
-                chat_id=user_id,
-                text=TEXT_ZODIAC_MAX_VISIT
-            )
+        #         # Send Kua Number Result
+        # file_path_voice = os.path.abspath(f"./data/ویس_تکنیک_عدد_شانس.m4a")
+        # if not os.path.exists(file_path_voice):
+        #     print("File not found:", file_path_voice)
+        # else:
+        #     print("File founded:", file_path_voice)
+        # with open(file_path_voice, "rb") as voice:
+        #     print("File opened successfully", file_path_voice)
+        #     await bot.send_audio(
+        #         chat_id=user_id,
+        #         audio=voice,
+        #         caption=f"ویس تکنیک عدد شانس",
+        #         timeout=60
+        #     )
+
+
+        await bot.send_message(
+            chat_id=user_id,
+            text=(
+                "سلام 🌱\n"
+                "خوشحالم که در مسیر نور و آگاهی قرار داری …\n\n"
+                "همین الان وارد کانال زیر بشو  چون به رایگان بهت گفتم که با توجه به اطلاعاتی که بدست آوردی امسال چه انرژی هایی برات فعاله!!!\n\n"
+                "🔹 به‌علاوه، یک پاکسازی ویژه «نگهبان نور» که  برای رفع دعا و طلسم و جادو و چشم زخم  و انرژی حسادت در سال ۲۰۲۶ باید حتما انجامش بدی چون تو رو دربرابر همه این خطر ها محافظت میکنه.\n\n"
+                "اگه هنوز وارد کانال تلگرام نشدی و این آموزش‌ها رو نداری،👇\n"
+                "همین الان روی لینک زیر بزن و وارد شو\n"
+                "تا از این اطلاعات ارزشمند جا نمونی\n\n"
+                "https://t.me/fereshte2026\n\n"
+                "سوالی هم داشتی از آیدی زیر بپرس 👇🏼\n"
+                "@fereshtehelp"
+            ),
+            parse_mode="HTML",
+        )    
+        
+
+
+        await user_zodiac_data.pop(user_id, None)
+        markup = dashboard_keyboard()
+        await bot.send_message(
+            chat_id=user_id,
+            text=f"اینجا چندتا گزینه وجود داره که میتونی انتخاب کنی:",
+            reply_markup=markup
+        )
+        await bot.answer_callback_query(callback_query_id=call.id)
+    else:
+        await bot.answer_callback_query(callback_query_id=call.id)
 
 
 
 @bot.message_handler(commands=['user_count'])
 async def get_user_count(message):
-    with Session(engine) as session:
-        statement = select(User)
-        users = session.exec(statement).all()
-        user_count = len(users)
+    user_count = await run_db(get_stat, engine=engine, key="users")
     await bot.send_message(
         message.chat.id,
         f"تعداد کل افراد: {user_count}"
     )
 
 
+@bot.message_handler(commands=['stats'])
+async def get_bot_stats(message):
+    if message.from_user.id not in ADMIN_IDS:
+        await bot.reply_to(message, "🚫 You are not authorized to use this command.")
+        return
+
+    # "/stats rebuild" recomputes the counters from the tables
+    if "rebuild" in message.text.split()[1:]:
+        await run_db(rebuild_stats, engine=engine)
+    stats = await run_db(get_stats, engine=engine)
+    score_count = stats.get("fengshui_scores", 0)
+    score_average = stats.get("fengshui_score_sum", 0) / score_count if score_count else 0
+    cities = "\n".join(f"  {city or '-'}: {count}" for city, count in stats["cities"])
+    await bot.send_message(
+        message.chat.id,
+        (
+            f"👥 تعداد کل افراد: {stats.get('users', 0)}\n"
+            f"🔢 محاسبات عدد شانس: {stats.get('kua_calculations', 0)}\n"
+            f"🐉 محاسبات زودیاک: {stats.get('zodiac_calculations', 0)}\n"
+            f"🏠 تست‌های فنگ شویی: {score_count} (میانگین امتیاز: {score_average:.1f})\n"
+            f"  زیر 40: {stats.get('fengshui_score:low', 0)}\n"
+            f"  بین 40 تا 70: {stats.get('fengshui_score:mid', 0)}\n"
+            f"  بالای 70: {stats.get('fengshui_score:high', 0)}\n\n"
+            f"🏙 شهرهای برتر:\n{cities}\n\n"
+            f"💬 گفتگوهای باز: {', '.join(f'{store.namespace}={len(store)}' for store in STATE_STORES)}"
+        )
+    )
+
+
+@bot.message_handler(commands=['export'])
+async def export_data(message):
+    if message.from_user.id not in ADMIN_IDS:
+        await bot.reply_to(message, "🚫 You are not authorized to use this command.")
+        return
+
+    # "/export [csv|jsonl] [table ...]", all tables as csv by default
+    args = message.text.split()[1:]
+    export_format = next((arg for arg in args if arg in EXPORT_FORMATS), "csv")
+    names = [arg for arg in args if arg in EXPORT_TABLES] or list(EXPORT_TABLES)
+    unknown = [arg for arg in args if arg not in EXPORT_FORMATS and arg not in EXPORT_TABLES]
+    if unknown:
+        await bot.reply_to(
+            message,
+            f"⚠️ Unknown: {' '.join(unknown)}\nTables: {' '.join(EXPORT_TABLES)}\nFormats: {' '.join(EXPORT_FORMATS)}"
+        )
+        return
+
+    for name in names:
+        path, count = await run_db(export_table, engine=engine, name=name, export_format=export_format)
+        try:
+            with open(path, "rb") as file:
+                await bot.send_document(
+                    message.chat.id,
+                    document=file,
+                    visible_file_name=f"{name}.{export_format}.gz",
+                    caption=f"{name}: {count}"
+                )
+        finally:
+            os.remove(path)
+
+
+def start_background_task(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+def contact_message_text(given_name):
+    return (
+        f"سلام {given_name} عزیز!\n"
+        "فرشته خسروی هستم.\n"
+        "برای ارتباط بهتر و همراهی همیشگیتون\n"
+        "حتما\n"
+        "✅کانال ایتا و\n"
+        "✅کانال روبیکا و\n"
+        "✅ کانال تلگرام\n"
+        "✅شماره پشتیبانی\n\n"
+        "رو داشته باشید\n\n"
+        "لینک کانال ایتا👇\n"
+        "https://eitaa.com/halekhob999\n\n"
+        "لینک کانال روبیکا👇\n"
+        "https://rubika.ir/helekhobmalkhob\n\n"
+        "لینک کانال تلگرام 👇\n"
+        "https://t.me/helekhobmalkhob\n\n"
+        "شماره پشتیبانی مستقیم👇\n"
+        "09364998675\n"
+        "آقای روان بخش\n\n"
+        "به امید روزای خوب 💚"
+        "دوستت دارم/فرشته💚\n\n\n"
+        "(اگر میخوایید پیامی برامون بفرستید روی دکمه زیر بزنین و پیامتون رو یکجا ارسال کنین)\n\n"
+    )
+
+
+async def send_contact_message_to_users(job, on_progress=None):
+    given_names = {}
+
+    async def prepare_batch(user_ids):
+        given_names.clear()
+        given_names.update(await run_db(get_given_names, engine=engine, user_ids=user_ids))
+
+    async def send(user_id):
+        keyboard = InlineKeyboardMarkup()
+        keyboard.add(
+            InlineKeyboardButton("✉️ ارسال پیام", callback_data=callback_router.encode("reply", "user", user_id))
+        )
+        await bot.send_message(
+            chat_id=user_id,
+            text=contact_message_text(given_names.get(user_id)),
+            parse_mode="HTML",
+            reply_markup=keyboard
+        )
+
+    return await run_broadcast_job(
+        engine=engine,
+        job=job,
+        send=send,
+        prepare_batch=prepare_batch,
+        on_progress=on_progress
+    )
+
+
+async def run_broadcast(job):
+    on_progress = progress_reporter(
+        bot=bot,
+        chat_id=job.admin_chat_id,
+        message_id=job.status_message_id
+    )
+    if job.kind == "contact":
+        stats = await send_contact_message_to_users(job=job, on_progress=on_progress)
+        result_text = f"Send Message to {stats.sent} Users!"
+    else:
+        stats = await forward_message_to_users(
+            engine=engine,
+            bot=bot,
+            job=job,
+            on_progress=on_progress
+        )
+        if job.segment:
+            cities = f" و شهرهای شامل: {job.cities}" if job.cities else ""
+            result_text = f" پیام به {stats.sent} نفر از گروه «{job.segment}»{cities} ارسال شد ✅"
+        elif job.cities:
+            result_text = f" پیام به {stats.sent} نفر با شهرهای شامل: {job.cities} ارسال شد ✅"
+        else:
+            result_text = f" پیام بدون فیلتر شهر، برای {stats.sent} نفر ارسال شد ✅"
+
+    await bot.send_message(
+        chat_id=job.admin_chat_id,
+        text=result_text,
+        reply_parameters=ReplyParameters(
+            message_id=job.command_message_id,
+            allow_sending_without_reply=True
+        )
+    )
+
+
+def start_broadcast(job):
+    """Run the job in this process, unless another one runs broadcasts."""
+    if not runs_broadcasts or job.id in running_broadcasts:
+        return
+    running_broadcasts.add(job.id)
+    task = start_background_task(run_broadcast(job))
+    task.add_done_callback(lambda _: running_broadcasts.discard(job.id))
+
+
+async def resume_broadcasts():
+    for job in await run_db(get_unfinished_broadcast_jobs, engine):
+        if job.id not in running_broadcasts:
+            print(f"Starting broadcast job {job.id} ({job.sent + job.failed}/{job.total})")
+            start_broadcast(job)
+
+
+async def watch_broadcasts():
+    """Run the jobs other workers create, they do not send themselves."""
+    while True:
+        await resume_broadcasts()
+        await asyncio.sleep(BROADCAST_POLL_INTERVAL)
+
+
 @bot.message_handler(commands=["send"])
 async def handle_broadcast(message):
     print(message.from_user.id)
-    if message.from_user.id not in [7690029281, 52260445, 917104518]:
+    if message.from_user.id not in ADMIN_IDS:
         await bot.reply_to(message, "🚫 You are not authorized to use this command.")
         return
     
     if message.reply_to_message:
-        parts = message.text.split()
-        city_keywords = parts[1:] if len(parts) > 1 else []
-        
+        # "/send [city ...] [kua=1,3] [element=Fire] [sign=Dragon] [score<40]"
+        parts = message.text.split()[1:]
+        city_keywords = [part for part in parts if not is_segment_token(part)]
+        try:
+            segment = parse_segment([part for part in parts if is_segment_token(part)])
+        except ValueError as e:
+            await bot.reply_to(message, f"⚠️ {e}")
+            return
+
+        members = None
+        segment_key = None
+        if segment:
+            segment_key, _ = await run_db(resolve_segment, engine=engine, segment=segment)
+            members = select_segment_members(segment_key)
+
         from_chat_id = message.chat.id
         message_id = message.reply_to_message.message_id
         
-        await bot.send_message(from_chat_id, "ارسال پیام آغاز شد!")
-        
-        send_count = await forward_message_to_users(
+        status = await bot.send_message(from_chat_id, "ارسال پیام آغاز شد!")
+        job = await run_db(
+            create_broadcast_job,
             engine=engine,
-            bot=bot,
+            kind="copy",
+            recipients=select_broadcast_recipients(city_keywords, members=members),
+            admin_chat_id=from_chat_id,
+            command_message_id=message.message_id,
+            status_message_id=status.message_id,
             from_chat_id=from_chat_id,
             message_id=message_id,
-            cities=city_keywords
+            cities="، ".join(city_keywords),
+            segment=segment_key
         )
-        
-        if city_keywords:
-            cities_str = "، ".join(city_keywords)
-            await bot.reply_to(
-                message,
-                f" پیام به {send_count} نفر با شهرهای شامل: {cities_str} ارسال شد ✅",
-            )
-        else:
-            await bot.reply_to(
-                message,
-                f" پیام بدون فیلتر شهر، برای {send_count} نفر ارسال شد ✅",
-            )        
+        start_broadcast(job)
     else:
         await bot.send_message(message.chat.id, "برای ارسال پیام گروهی، باید روی آن پیام ریپلای کرده و دستور /send را بنویسی.")
 
@@ -1089,10 +1429,7 @@ async def reset(message):
         return
     
     try:        
-        with Session(engine) as session:
-            session.exec(update(Kua).values(count_visit=0))
-            session.exec(update(Zodiac).values(count_visit=0))
-            session.commit()
+        await run_db(reset_visit_counts, engine=engine)
         await bot.reply_to(message, "✅ All count_visit values have been reset to zero.")
         
     except Exception as e:
@@ -1102,74 +1439,29 @@ async def reset(message):
 
 @bot.message_handler(commands=['send_message'])
 async def send_message(message):
-    with Session(engine) as session:
-        result = session.exec(text(f"SELECT * FROM user"))
-        results = [(row.user_id, row.given_name, row.city) for row in result.fetchall()]
-    n = 0
-    for item in results:
-        try:
-            user_id, given_name, city = item
-            message_text = (
-                f"سلام {given_name} عزیز!\n"
-                "فرشته خسروی هستم.\n"
-                "برای ارتباط بهتر و همراهی همیشگیتون\n"
-                "حتما\n"
-                "✅کانال ایتا و\n"
-                "✅کانال روبیکا و\n"
-                "✅ کانال تلگرام\n"
-                "✅شماره پشتیبانی\n\n"
-                "رو داشته باشید\n\n"
-                "لینک کانال ایتا👇\n"
-                "https://eitaa.com/halekhob999\n\n"
-                "لینک کانال روبیکا👇\n"
-                "https://rubika.ir/helekhobmalkhob\n\n"
-                "لینک کانال تلگرام 👇\n"
-                "https://t.me/helekhobmalkhob\n\n"
-                "شماره پشتیبانی مستقیم👇\n"
-                "09364998675\n"
-                "آقای روان بخش\n\n"
-                "به امید روزای خوب 💚"
-                "دوستت دارم/فرشته💚\n\n\n"
-                "(اگر میخوایید پیامی برامون بفرستید روی دکمه زیر بزنین و پیامتون رو یکجا ارسال کنین)\n\n"
-            )
-            
-            keyboard = InlineKeyboardMarkup()
-            keyboard.add(
-                InlineKeyboardButton("✉️ ارسال پیام", callback_data=f"reply_{user_id}")
-            )
-            
-            await bot.send_message(
-                chat_id=user_id,
-                text=message_text,
-                parse_mode="HTML",
-                reply_markup=keyboard
-            )
-            await asyncio.sleep(0.3)
-            n += 1
-        except apihelper.ApiException as e:
-            print(f"Error for {user_id}: {e}")
-        except Exception as e:
-            print(f"Unexpected error for {user_id}: {e}")
-            
-    await bot.send_message(
-        chat_id=message.chat.id,
-        text=f"Send Message to {n} Users!"
+    if message.from_user.id not in ADMIN_IDS:
+        await bot.reply_to(message, "🚫 You are not authorized to use this command.")
+        return
+
+    status = await bot.send_message(message.chat.id, "ارسال پیام آغاز شد!")
+    job = await run_db(
+        create_broadcast_job,
+        engine=engine,
+        kind="contact",
+        recipients=select_broadcast_recipients(None),
+        admin_chat_id=message.chat.id,
+        command_message_id=message.message_id,
+        status_message_id=status.message_id
     )
+    start_broadcast(job)
 
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("reply_"))
-async def handle_reply_request(call):
+@callback_router.route("reply", "user")
+async def handle_reply_request(call, value):
     user_id = call.from_user.id
 
-    with Session(engine) as session:
-        state = session.get(UserReplyState, user_id)
-        if state:
-            state.is_waiting = True
-        else:
-            state = UserReplyState(user_id=user_id, is_waiting=True)
-            session.add(state)
-        session.commit()
+    text_router.set(user_id, "awaiting_reply")
 
     await bot.send_message(
         chat_id=user_id,
@@ -1177,24 +1469,25 @@ async def handle_reply_request(call):
     )
 
 
-@bot.message_handler(func=lambda msg: True)
+# Broadcasts sent before signed payloads carry "reply_<id>", the id is not needed.
+@callback_router.prefix("reply_")
+async def handle_legacy_reply_request(call):
+    await handle_reply_request(call, None)
+
+
+@text_router.state("awaiting_reply")
 async def handle_user_reply(msg):
     user_id = msg.from_user.id
-    with Session(engine) as session:
-        state = session.get(UserReplyState, user_id)
-        if state and state.is_waiting:
-            state.is_waiting = False
-            session.commit()
-
-            await bot.send_message(
-                chat_id=6561974562,
-                text=f"📩 پیام جدید از {msg.from_user.full_name} (ID: {user_id}):\n\n{msg.text}",
-            )
+    await text_router.clear(msg.chat.id)
+    await bot.send_message(
+        chat_id=6561974562,
+        text=f"📩 پیام جدید از {msg.from_user.full_name} (ID: {user_id}):\n\n{msg.text}",
+    )
 
-            await bot.send_message(
-                chat_id=user_id,
-                text="پیامت رسید ✅ ممنونم ازت ❤️"
-            )
+    await bot.send_message(
+        chat_id=user_id,
+        text="پیامت رسید ✅ ممنونم ازت ❤️"
+    )
 
 
 
@@ -1362,12 +1655,10 @@ async def simulate_progress(chat_id, n, text):
     await bot.delete_message(chat_id=chat_id, message_id=message.message_id)
 
 
-user_poll_state = {}
-
 @bot.message_handler(commands=['fengshui_test'])
 async def start_fengshui_test(message):
     user_id = message.chat.id
-    user_poll_state[user_id] = {"current": 0, "answers": []}
+    user_poll_state.set(user_id, {"current": 0, "answers": []})
     await bot.send_message(
             chat_id=user_id,
             text=(
@@ -1393,7 +1684,7 @@ async def start_fengshui_test(message):
 
 
 async def send_fengshui_question(user_id):
-    state = user_poll_state.get(user_id)
+    state = await user_poll_state.get(user_id)
     if state is None:
         return
     idx = state["current"]
@@ -1401,9 +1692,10 @@ async def send_fengshui_question(user_id):
         q = POLL_QUESTIONS[idx]
         markup = InlineKeyboardMarkup()
         for i, ans in enumerate(q["a"]):
-            markup.add(InlineKeyboardButton(ans["text"], callback_data=f"poll_{idx}_{i}"))
+            markup.add(InlineKeyboardButton(ans["text"], callback_data=callback_router.encode("poll", "answer", f"{idx}.{i}")))
         sent_message = await bot.send_message(user_id, q["q"], reply_markup=markup, parse_mode="HTML")
         state["last_question_message_id"] = sent_message.message_id
+        user_poll_state.set(user_id, state)
     else:
         total = sum(state["answers"])
         await bot.send_message(user_id, f"📢 سوالات تمام شد!")
@@ -1420,8 +1712,9 @@ async def send_fengshui_question(user_id):
             parse_mode="HTML",
         )
         
-        insert_to_fengshui_score_table(
-            engine=engine,
+        write_buffer.submit_background(
+            insert_to_fengshui_score_table,
+            key=user_id,
             user_id=user_id,
             score=total
         )
@@ -1455,51 +1748,57 @@ async def send_fengshui_question(user_id):
             parse_mode="HTML"
         )
 
-        user_poll_state.pop(user_id, None)
-
+        await user_poll_state.pop(user_id, None)
 
-user_data_form = {}
 
-@bot.callback_query_handler(func=lambda call: call.data == "collect_info")
+@callback_router.literal("collect_info")
 async def handle_collect_info(call):
     user_id = call.message.chat.id
-    user_data_form[user_id] = {}
+    user_data_form.set(user_id, {})
+    text_router.set(user_id, "form_f_name")
     await bot.send_message(user_id, "🧑 لطفا اسم خود را وارد کنید:")
 
-@bot.message_handler(func=lambda message: message.chat.id in user_data_form and "f_name" not in user_data_form[message.chat.id])
+@text_router.state("form_f_name")
 async def get_f_name(message):
-    user_data_form[message.chat.id]["f_name"] = message.text
+    await user_data_form.update(message.chat.id, f_name=message.text)
+    text_router.set(message.chat.id, "form_l_name")
     await bot.send_message(message.chat.id, "🧑 لطفا فامیل خود را وارد کنید:")
 
-@bot.message_handler(func=lambda message: message.chat.id in user_data_form and "l_name" not in user_data_form[message.chat.id])
+@text_router.state("form_l_name")
 async def get_l_name(message):
-    user_data_form[message.chat.id]["l_name"] = message.text
+    await user_data_form.update(message.chat.id, l_name=message.text)
+    text_router.set(message.chat.id, "form_phone")
     await bot.send_message(message.chat.id, "📱 لطفا شماره تلفن خود را وارد کنید:")
 
-@bot.message_handler(func=lambda message: message.chat.id in user_data_form and "phone" not in user_data_form[message.chat.id])
+@text_router.state("form_phone")
 async def get_phone(message):
-    user_data_form[message.chat.id]["phone"] = message.text
+    await user_data_form.update(message.chat.id, phone=message.text)
+    text_router.set(message.chat.id, "form_city")
     await bot.send_message(message.chat.id, "🏙 لطفا شهر محل سکونت خود را وارد کنید:")
 
-@bot.message_handler(func=lambda message: message.chat.id in user_data_form and "city" not in user_data_form[message.chat.id])
+@text_router.state("form_city")
 async def get_city(message):
-    user_data_form[message.chat.id]["city"] = message.text
+    await user_data_form.update(message.chat.id, city=message.text)
+    text_router.set(message.chat.id, "form_metrage")
     await bot.send_message(message.chat.id, "🏠 لطفا متراژ خانه خود را وارد کنید:")
 
-@bot.message_handler(func=lambda message: message.chat.id in user_data_form and "metrage" not in user_data_form[message.chat.id])
+@text_router.state("form_metrage")
 async def get_metrage(message):
-    user_data_form[message.chat.id]["metrage"] = message.text
+    await user_data_form.update(message.chat.id, metrage=message.text)
+    text_router.set(message.chat.id, "form_problem")
     await bot.send_message(message.chat.id, "❓ مشکل یا چالشی که دارید را توضیح دهید:")
 
-@bot.message_handler(func=lambda message: message.chat.id in user_data_form and "problem" not in user_data_form[message.chat.id])
+@text_router.state("form_problem")
 async def get_problem(message):
     user_id = message.chat.id
-    user_data_form[user_id]["problem"] = message.text
+    await user_data_form.update(user_id, problem=message.text)
 
-    data = user_data_form.pop(user_id)
+    data = await user_data_form.pop(user_id)
+    await text_router.clear(user_id)
 
-    insert_to_fengshui_test_table(
-        engine=engine,
+    write_buffer.submit_background(
+        insert_to_fengshui_test_table,
+        key=user_id,
         user_id=user_id,
         f_name=data["f_name"],
         l_name=data["l_name"],
@@ -1512,23 +1811,23 @@ async def get_problem(message):
     await bot.send_message(user_id, "✅ اطلاعات شما با موفقیت ذخیره شد. همکاران ما با شما تماس خواهند گرفت.")
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("poll_"))
-async def handle_poll_answer(call):
+@callback_router.route("poll", "answer")
+async def handle_poll_answer(call, value):
     user_id = call.message.chat.id
-    state = user_poll_state.get(user_id)
+    state = await user_poll_state.get(user_id)
     if not state:
         await bot.answer_callback_query(call.id, "لطفا با /fengshui_test شروع کنید.")
         return
-    _, idx, ans_idx = call.data.split("_")
+    idx, ans_idx = value.split(".")
     idx = int(idx)
     ans_idx = int(ans_idx)
     if idx != state["current"]:
         await bot.answer_callback_query(call.id, "این سوال قبلا پاسخ داده شده است.")
         return
     score = POLL_QUESTIONS[idx]["a"][ans_idx]["score"]
-    answer_text = POLL_QUESTIONS[idx]["a"][ans_idx]["text"]
     state["answers"].append(score)
     state["current"] += 1
+    user_poll_state.set(user_id, state)
     
     last_msg_id = state.get("last_question_message_id")
     if last_msg_id:
@@ -1548,6 +1847,23 @@ async def handle_poll_answer(call):
 
 
 
+# Registered last, so command handlers anywhere in this file are tried first.
+@bot.message_handler(func=lambda message: True)
+async def handle_text_message(message):
+    await text_router.dispatch(message)
+
+
+@bot.callback_query_handler(func=lambda call: True)
+async def handle_callback_query(call):
+    if not await callback_router.dispatch(call):
+        # Forged data, or a button from before the last payload change
+        await bot.answer_callback_query(
+            callback_query_id=call.id,
+            text=TEXT_EXPIRED_BUTTON
+        )
+
+
+
 async def main():
     await bot.set_my_description(
         description=(     
@@ -1623,14 +1939,99 @@ async def main():
     #     await bot.edit_message_reply_markup(call.message.chat.id, call.message.message_id, reply_markup=None)   
     
     
+    if WORKERS > 1:
+        await run_supervisor()
+        return
+
+    await resume_broadcasts()
+
     try:
         print("Bot is running ...")
-        await bot.polling(non_stop=True)
+        if WEBHOOK_URL:
+            await run_webhook(
+                bot=bot,
+                url=WEBHOOK_URL,
+                path=WEBHOOK_PATH,
+                host=WEBHOOK_HOST,
+                port=WEBHOOK_PORT,
+                secret_token=WEBHOOK_SECRET,
+                remove_on_shutdown=WEBHOOK_REMOVE_ON_SHUTDOWN,
+                allowed_updates=ALLOWED_UPDATES
+            )
+        else:
+            await bot.delete_webhook()
+            await bot.polling(non_stop=True, allowed_updates=ALLOWED_UPDATES)
     except Exception as e:
         print(f"An error occurred: {e}")
         await asyncio.sleep(5)
+    finally:
+        await bot.update_executor.join()
+        await write_buffer.close()
+        state_backend.close()
+
+
+
+# ------------------------------------------------------------------------------ #
+#                              Worker Processes
+# ------------------------------------------------------------------------------ #
+
+async def run_supervisor():
+    if STATE_BACKEND != "sqlite":
+        raise RuntimeError("WORKERS > 1 requires STATE_BACKEND=sqlite")
+    supervisor = Supervisor(worker_target=worker_process, workers=WORKERS)
+    supervisor.start()
+    watch = asyncio.create_task(supervisor.watch())
+    try:
+        print("Bot is running ...")
+        if WEBHOOK_URL:
+            await run_webhook(
+                bot=bot,
+                url=WEBHOOK_URL,
+                path=WEBHOOK_PATH,
+                host=WEBHOOK_HOST,
+                port=WEBHOOK_PORT,
+                secret_token=WEBHOOK_SECRET,
+                remove_on_shutdown=WEBHOOK_REMOVE_ON_SHUTDOWN,
+                allowed_updates=ALLOWED_UPDATES,
+                dispatch=supervisor.dispatch
+            )
+        else:
+            await bot.delete_webhook()
+            await run_polling_supervisor(
+                bot=bot,
+                dispatch=supervisor.dispatch,
+                allowed_updates=ALLOWED_UPDATES
+            )
+    finally:
+        watch.cancel()
+        await asyncio.to_thread(supervisor.stop)
+        await bot.close_session()
+        state_backend.close()
+
+
+def worker_process(index, queue):
+    ignore_shutdown_signals()
+    asyncio.run(worker_main(index, queue))
+
+
+async def worker_main(index, queue):
+    global runs_broadcasts
+    # The database was set up by the supervisor, state is read on demand.
+    load_callback_secret()
+    media_registry.load(engine)
+    runs_broadcasts = index == 0
+    if runs_broadcasts:
+        start_background_task(watch_broadcasts())
+    try:
+        # Broadcasts still running are cancelled and resume on the next start.
+        await run_worker(bot=bot, queue=queue)
+    finally:
+        await write_buffer.close()
+        state_backend.close()
+        await bot.close_session()
 
 
 
 if __name__ == "__main__":
+    setup_database()
     asyncio.run(main())
@@ -0,0 +1,22 @@
+"""Time the New Year table against a lunardate conversion per lookup.
+
+    python -m benchmarks.chinese_calendar
+"""
+import timeit
+import lunardate
+from utils.chinese_calendar import chinese_year
+
+
+def lunardate_chinese_year(year, month, day):
+    return lunardate.LunarDate.fromSolarDate(year, month, day).year
+
+
+def benchmark(number=20000):
+    dates = [(1941 + i % 100, 1 + i % 12, 1 + i % 28) for i in range(number)]
+    for name, func in (("table", chinese_year), ("lunardate", lunardate_chinese_year)):
+        seconds = timeit.timeit(lambda: [func(*date) for date in dates], number=1)
+        print(f"{name:>10}: {seconds / number * 1e6:.2f} us per lookup")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,19 @@
+"""Time the batch converter against the scalar one over 1300-1500 AP.
+
+    python -m benchmarks.jalali_batch
+"""
+import timeit
+from utils import jalali
+from utils.jalali_batch import persian_dates, persian_to_gregorian
+
+
+def benchmark(first_year=1300, last_year=1500):
+    years, months, days = persian_dates(first_year, last_year)
+    dates = list(zip(years.tolist(), months.tolist(), days.tolist()))
+    batch = timeit.timeit(lambda: persian_to_gregorian(years, months, days), number=10) / 10
+    scalar = timeit.timeit(lambda: [jalali.Persian(date).gregorian_tuple() for date in dates], number=1)
+    print(f"{len(dates)} dates: batch {batch * 1e3:.1f} ms, scalar {scalar * 1e3:.1f} ms ({scalar / batch:.0f}x)")
+
+
+if __name__ == "__main__":
+    benchmark()
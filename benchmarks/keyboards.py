@@ -0,0 +1,31 @@
+"""Time building the month keyboard per send against the cached markup.
+
+    python -m benchmarks.keyboards
+"""
+import timeit
+from utils.assets import PERSIAN_MONTHS, create_inline_keyboard
+from utils.keyboards import cached_markup
+
+
+def benchmark(number=100_000):
+    def build():
+        return create_inline_keyboard(
+            options=range(1, 13), columns=3, callback_prefix="month_", labels=PERSIAN_MONTHS
+        ).to_json()
+
+    def cached():
+        return cached_markup(
+            ("month_", 1, 12),
+            lambda: create_inline_keyboard(
+                options=range(1, 13), columns=3, callback_prefix="month_", labels=PERSIAN_MONTHS
+            )
+        ).to_json()
+
+    assert build() == cached()
+    for name, func in (("build", build), ("cached", cached)):
+        seconds = timeit.timeit(func, number=number)
+        print(f"{name:>7}: {seconds / number * 1e6:.2f} us per month keyboard")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,42 @@
+"""Compare a chain of filter lambdas against one StateRouter lookup.
+
+    python -m benchmarks.router
+"""
+import timeit
+import asyncio
+from utils.router import StateRouter
+from utils.state import StateStore, MemoryStateBackend
+
+
+def benchmark(handler_count=9, users=10_000, number=200_000):
+    states = [f"state_{i}" for i in range(handler_count)]
+    flows = {user_id: {"state": states[user_id % handler_count]} for user_id in range(users)}
+    filters = [
+        (lambda state: lambda user_id: flows.get(user_id, {}).get("state") == state)(state)
+        for state in states
+    ]
+
+    router = StateRouter(StateStore("benchmark", MemoryStateBackend(), max_entries=users))
+    for state in states:
+        router.state(state)(lambda message: None)
+    for user_id, flow in flows.items():
+        router.set(user_id, flow["state"])
+
+    # Both are coroutines, as handler_for is, so only the lookup differs.
+    async def chain(user_id):
+        for matches in filters:
+            if matches(user_id):
+                return matches
+
+    async def route_all(route):
+        for user_id in user_ids:
+            await route(user_id)
+
+    user_ids = [i * 7919 % users for i in range(number)]
+    for name, route in (("filters", chain), ("router", router.handler_for)):
+        seconds = timeit.timeit(lambda: asyncio.run(route_all(route)), number=1)
+        print(f"{name:>8}: {seconds / number * 1e6:.2f} us per message ({handler_count} handlers)")
+
+
+if __name__ == "__main__":
+    benchmark()
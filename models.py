@@ -1,5 +1,6 @@
 from datetime import datetime, timezone
 from typing import Optional
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field
 
 
@@ -20,6 +21,9 @@ class Kua(SQLModel, table=True):
     birth_date: Optional[str]
     kua_number: Optional[str]
     count_visit: Optional[int] = 0
+    quota_period: Optional[str] = Field(default="0", sa_column_kwargs={"server_default": "0"})
+    # Every calculation ever made, count_visit only covers the current quota period.
+    calculations: Optional[int] = Field(default=0, sa_column_kwargs={"server_default": "0"})
 
 
 class Zodiac(SQLModel, table=True):
@@ -28,6 +32,16 @@ class Zodiac(SQLModel, table=True):
     chinese_sign: Optional[str]
     chinese_element: Optional[str]
     count_visit: Optional[int] = 0
+    quota_period: Optional[str] = Field(default="0", sa_column_kwargs={"server_default": "0"})
+    # Every calculation ever made, count_visit only covers the current quota period.
+    calculations: Optional[int] = Field(default=0, sa_column_kwargs={"server_default": "0"})
+
+
+class QuotaPeriod(SQLModel, table=True):
+    feature: str = Field(primary_key=True)
+    epoch: int = 0
+    window: Optional[str]
+    update_date: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 
 class Mashhad(SQLModel, table=True):
@@ -53,6 +67,81 @@ class Fengshui_Score(SQLModel, table=True):
     create_date: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 
+class ChannelMember(SQLModel, table=True):
+    user_id: int = Field(primary_key=True)
+    channel: str = Field(primary_key=True)
+    status: Optional[str]
+    update_date: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    # Set for statuses looked up through the API, which go stale if a
+    # chat_member update is missed. Statuses from chat_member updates keep None.
+    expires_at: Optional[float]
+
+
+class Stat(SQLModel, table=True):
+    key: str = Field(primary_key=True)
+    value: int = 0
+
+
+class Segment(SQLModel, table=True):
+    key: str = Field(primary_key=True)
+    version: int = 0
+    total: int = 0
+    update_date: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class SegmentMember(SQLModel, table=True):
+    segment: str = Field(primary_key=True)
+    user_id: int = Field(primary_key=True)
+
+
 class UserReplyState(SQLModel, table=True):
     user_id: int = Field(primary_key=True)
-    is_waiting: bool = Field(default=False)
\ No newline at end of file
+    is_waiting: bool = Field(default=False)
+
+class BroadcastJob(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    kind: str
+    admin_chat_id: int
+    command_message_id: Optional[int]
+    status_message_id: Optional[int]
+    from_chat_id: Optional[int]
+    message_id: Optional[int]
+    cities: Optional[str]
+    segment: Optional[str]
+    status: str = Field(default="running", index=True)
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    create_date: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    finish_date: Optional[datetime]
+
+
+class BroadcastRecipient(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_broadcastrecipient_job_id_status", "job_id", "status"),
+    )
+    job_id: int = Field(primary_key=True)
+    user_id: int = Field(primary_key=True)
+    status: str = Field(default="pending")
+
+
+class MediaAsset(SQLModel, table=True):
+    path: str = Field(primary_key=True)
+    sha256: str
+    size: int
+    mtime_ns: int
+    file_id: Optional[str]
+    update_date: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class Secret(SQLModel, table=True):
+    name: str = Field(primary_key=True)
+    value: str
+    create_date: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class ConversationState(SQLModel, table=True):
+    namespace: str = Field(primary_key=True)
+    key: int = Field(primary_key=True)
+    data: str
+    expires_at: float = Field(index=True)
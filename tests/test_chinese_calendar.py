@@ -0,0 +1,28 @@
+import datetime
+import pytest
+from utils.chinese_calendar import NEW_YEAR_ORDINALS, LAST_ORDINAL, chinese_year
+
+lunardate = pytest.importorskip("lunardate")
+
+
+def test_matches_lunardate_on_every_day():
+    day = datetime.date.fromordinal(NEW_YEAR_ORDINALS[0])
+    last_day = datetime.date.fromordinal(LAST_ORDINAL)
+    checked = 0
+    while day <= last_day:
+        try:
+            expected = lunardate.LunarDate.fromSolarDate(day.year, day.month, day.day).year
+        except ValueError:
+            # Past the end of lunardate's data
+            break
+        assert chinese_year(day.year, day.month, day.day) == expected, day
+        checked += 1
+        day += datetime.timedelta(days=1)
+    assert checked > 365 * 199
+
+
+@pytest.mark.parametrize("ordinal", [NEW_YEAR_ORDINALS[0] - 1, LAST_ORDINAL + 1])
+def test_rejects_dates_outside_the_table(ordinal):
+    day = datetime.date.fromordinal(ordinal)
+    with pytest.raises(ValueError):
+        chinese_year(day.year, day.month, day.day)
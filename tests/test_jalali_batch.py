@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+from utils import jalali
+from utils.jalali_batch import (
+    persian_dates,
+    gregorian_dates,
+    persian_to_gregorian,
+    gregorian_to_persian,
+)
+
+FIRST_YEAR = 1300
+LAST_YEAR = 1500
+
+
+def test_persian_to_gregorian_matches_scalar():
+    years, months, days = persian_dates(FIRST_YEAR, LAST_YEAR)
+    batch = np.stack(persian_to_gregorian(years, months, days), axis=1)
+    scalar = np.array([
+        jalali.Persian((y, m, d)).gregorian_tuple() for y, m, d in zip(years.tolist(), months.tolist(), days.tolist())
+    ])
+    np.testing.assert_array_equal(batch, scalar)
+
+
+def test_gregorian_to_persian_matches_scalar():
+    years, months, days = gregorian_dates(FIRST_YEAR + 621, LAST_YEAR + 621)
+    batch = np.stack(gregorian_to_persian(years, months, days), axis=1)
+    scalar = np.array([
+        jalali.Gregorian((y, m, d)).persian_tuple() for y, m, d in zip(years.tolist(), months.tolist(), days.tolist())
+    ])
+    np.testing.assert_array_equal(batch, scalar)
+
+
+def test_invalid_dates_raise():
+    with pytest.raises(ValueError):
+        persian_to_gregorian([1400], [7], [31])
+    with pytest.raises(ValueError):
+        gregorian_to_persian([2023], [2], [29])
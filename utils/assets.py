@@ -1,15 +1,22 @@
 import asyncio
+import time
 import datetime
-import lunardate
-from sqlmodel import SQLModel, create_engine, Session, select, text
-from utils import jalali
-from models import User, Kua, Zodiac, Mashhad, Fengshui_Test, Fengshui_Score
-from telebot.async_telebot import AsyncTeleBot
+from sqlmodel import Session, select, text, update
+from utils import jalali, lookup_tables, build_lookup_tables, chinese_calendar
+from utils.broadcast import run_broadcast_job
+from utils.database import run_db
+from utils.city_index import select_users_by_cities
+from utils.membership import MEMBER_STATUSES, membership_cache
+from utils.keyboards import cached_markup
+from utils.callbacks import callback_router
+from models import User, Kua, Zodiac, Mashhad, Fengshui_Test, Fengshui_Score, ChannelMember, UserReplyState, QuotaPeriod
+from telebot.asyncio_helper import ApiTelegramException
 from telebot.types import (
     InlineKeyboardMarkup,
     InlineKeyboardButton,
 )
-from sqlalchemy import or_
+from sqlalchemy import func, case, cast, String
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
 
 
@@ -66,6 +73,9 @@ CHINESE_ELEMENTS = [
     "Earth"
 ]
 
+# Jalali Birth Years Offered By The Date Picker
+BIRTH_YEARS = range(1320, 1420)
+
 CHINESE_ELEMENTS_FARSI = {
     "Metal": "فلز",
     "Water": "آب",
@@ -76,6 +86,10 @@ CHINESE_ELEMENTS_FARSI = {
 
 
 def dashboard_keyboard():
+    return cached_markup("dashboard", build_dashboard_keyboard)
+
+
+def build_dashboard_keyboard():
     markup = InlineKeyboardMarkup()
     markup.add(
         InlineKeyboardButton(text="تست فنگ شویی", callback_data="fengshui_test_button"),
@@ -95,18 +109,44 @@ def dashboard_keyboard():
     return markup
 
 
-async def is_user_member(bot, user_id, channels):
-    remaining_channels = []
-    try:
-        for cid in channels:
-            member = await bot.get_chat_member(
-                chat_id=f"@{cid}",
-                user_id=user_id
+async def is_user_member(bot, user_id, channels, engine=None, refresh=False):
+    async def load_membership(user_id, cid):
+        # Users seen through chat_member updates are answered from the ledger.
+        if engine is not None and not refresh:
+            status = await run_db(
+                get_channel_member_status,
+                engine=engine,
+                user_id=user_id,
+                channel=cid
+            )
+            if status is not None:
+                return status in MEMBER_STATUSES
+        member = await bot.get_chat_member(
+            chat_id=f"@{cid}",
+            user_id=user_id
+        )
+        is_member = member.status in MEMBER_STATUSES
+        if engine is not None:
+            # Expires like the cache entry, so a missed leave is noticed.
+            await run_db(
+                insert_to_channel_member_table,
+                engine=engine,
+                user_id=user_id,
+                channel=cid,
+                status=member.status,
+                ttl=membership_cache.ttl(is_member)
             )
-            if member.status not in ['member', 'administrator', 'creator']:
-                remaining_channels.append(cid)
-    except Exception as e:
-        print(f"Error Checking Membership: {e}")
+        return is_member
+
+    async def check(cid):
+        try:
+            return await membership_cache.fetch(user_id, cid, load_membership)
+        except Exception as e:
+            print(f"Error Checking Membership: {e}")
+            return True
+
+    results = await asyncio.gather(*(check(cid) for cid in channels))
+    remaining_channels = [cid for cid, is_member in zip(channels, results) if not is_member]
     return len(remaining_channels) == 0, remaining_channels
 
 
@@ -144,34 +184,37 @@ async def send_join_channel_button(bot, chat_id, channels):
 
 
 
-async def user_channel_check(engine, table, bot, message, user_id, max_visit, channels):
-    with Session(engine) as session:
-        statement = select(table).where(table.user_id == user_id)
-        user = session.exec(statement).first()
-        is_member, rm_channels = await is_user_member(bot=bot, user_id=user_id, channels=channels)
-        # if user and\
-        #     user.count_visit >= max_visit and\
-        #         not is_member:
-        if not is_member:
-            await send_join_channel_button(
-                bot=bot,
-                chat_id=message.chat.id,
-                channels=rm_channels
-            )
-            return False
-        return True
+async def user_channel_check(engine, table, bot, message, user_id, max_visit, channels, refresh=False):
+    is_member, rm_channels = await is_user_member(
+        bot=bot,
+        user_id=user_id,
+        channels=channels,
+        engine=engine,
+        refresh=refresh
+    )
+    if not is_member:
+        await send_join_channel_button(
+            bot=bot,
+            chat_id=message.chat.id,
+            channels=rm_channels
+        )
+        return False
+    return True
+
 
 
+def create_inline_keyboard(options, columns=3, callback_prefix="option_", labels=None, callback_data=None):
+    """Generate inline keyboards with flexible column layout.
 
-def create_inline_keyboard(options, columns=3, callback_prefix="option_"):
-    """Generate inline keyboards with flexible column layout."""
+    callback_data(option) overrides the default f"{callback_prefix}{option}".
+    """
     markup = InlineKeyboardMarkup()
     row = []
     for i, option in enumerate(options):
         row.append(
             InlineKeyboardButton(
-                text=PERSIAN_MONTHS[option] if "month" in callback_prefix else str(option),
-                callback_data=f"{callback_prefix}{option}")
+                text=labels[option] if labels else str(option),
+                callback_data=callback_data(option) if callback_data else f"{callback_prefix}{option}")
             )
         if len(row) == columns or i == len(options) - 1:
             markup.add(*row)
@@ -180,186 +223,308 @@ def create_inline_keyboard(options, columns=3, callback_prefix="option_"):
 
 
 
+def persian_month_days(
+    year: int,
+    month: int
+) -> int:
+    if month <= 6:
+        return 31
+    if month <= 11:
+        return 30
+    # Esfand has 30 days in leap years, otherwise the 30th is 1 Farvardin.
+    gregorian = jalali.Persian((year, 12, 30)).gregorian_tuple()
+    return 30 if jalali.Gregorian(gregorian).persian_tuple() == (year, 12, 30) else 29
+
+
+
 def is_valid_date(
     year: int,
     month: int,
     day: int
 ) -> bool:
-    try:
-        jalali.Persian((year, month, day)).gregorian_tuple()
-        # datetime(year, month, day)
-        return True
-    except ValueError:
+    if year < 1 or not 1 <= month <= 12:
         return False
+    return 1 <= day <= persian_month_days(year, month)
 
 
 
 def extract_chinese_year(
-        date_string: str
+        year: int,
+        month: int,
+        day: int
     ) -> int:
-    date = datetime.datetime.strptime(date_string, "%Y-%m-%d")
-    lunar_date = lunardate.LunarDate.fromSolarDate(date.year, date.month, date.day)
-    return int(lunar_date.year)
+    return chinese_calendar.chinese_year(year, month, day)
+
 
 
+def check_lookup_tables():
+    """Fail fast if the compiled tables are stale or miss a selectable year."""
+    if lookup_tables.LOOKUP_TABLES_VERSION != build_lookup_tables.LOOKUP_TABLES_VERSION:
+        raise RuntimeError("utils/lookup_tables.py is outdated, run: python -m utils.build_lookup_tables")
+    if lookup_tables.SOURCE_DIGEST != build_lookup_tables.source_digest():
+        print("Warning: utils/*.json changed, run: python -m utils.build_lookup_tables")
+
+    first_year = jalali.Persian((BIRTH_YEARS[0], 1, 1)).gregorian_year
+    last_year = jalali.Persian((BIRTH_YEARS[-1], 12, 29)).gregorian_year
+    for name, table_first_year, table in (
+        ("kua", lookup_tables.KUA_FIRST_YEAR, lookup_tables.KUA_MALE),
+        ("kua", lookup_tables.KUA_FIRST_YEAR, lookup_tables.KUA_FEMALE),
+        ("zodiac", lookup_tables.ZODIAC_FIRST_YEAR, lookup_tables.ZODIAC_YEARS),
+    ):
+        if table_first_year > first_year or table_first_year + len(table) <= last_year:
+            raise RuntimeError(f"The {name} table does not cover {first_year}-{last_year}")
+
+
+def lookup_year(table, first_year, birth_year):
+    index = birth_year - first_year
+    if not 0 <= index < len(table):
+        raise ValueError(f"Birth year {birth_year} is out of range")
+    return table[index]
+
 
 def calculate_kua_number(
-    kua_data,
     birth_year: int,
     gender: str
 ) -> int:
-    
-    kua_number = kua_data.get(gender, {}).get(str(birth_year), None)
-    
-    # year_sum = sum(map(int, str(birth_year)[-2:]))
-
-    # while year_sum > 9:
-    #     year_sum = sum(map(int, str(year_sum)))
-    
-    # kua_number = 0
-
-    # if gender.lower() == "male":
-    #     kua_number = 10 - year_sum
-    #     kua_number = 9 if kua_number == 0 else (2 if kua_number == 5 else kua_number)
-    # elif gender.lower() == "female":
-    #     kua_number = year_sum + 5
-    #     kua_number = sum(map(int, str(kua_number))) if kua_number > 9 else kua_number
-    #     kua_number = 9 if kua_number == 0 else (8 if kua_number == 5 else kua_number)
+    table = lookup_tables.KUA_MALE if gender == "male" else lookup_tables.KUA_FEMALE
+    return lookup_year(table, lookup_tables.KUA_FIRST_YEAR, birth_year)
 
-    return kua_number
 
 def calculate_zodiac_animal(
-    zodiac_animal_dataset,
     birth_year: int,
-) -> int:
-    
-    zodiac_animal = zodiac_animal_dataset.get(str(birth_year), None)
-    
-    # year_sum = sum(map(int, str(birth_year)[-2:]))
+) -> str:
+    sign_index = lookup_year(lookup_tables.ZODIAC_YEARS, lookup_tables.ZODIAC_FIRST_YEAR, birth_year)
+    return lookup_tables.ZODIAC_SIGNS[sign_index]
 
-    # while year_sum > 9:
-    #     year_sum = sum(map(int, str(year_sum)))
-    
-    # kua_number = 0
 
-    # if gender.lower() == "male":
-    #     kua_number = 10 - year_sum
-    #     kua_number = 9 if kua_number == 0 else (2 if kua_number == 5 else kua_number)
-    # elif gender.lower() == "female":
-    #     kua_number = year_sum + 5
-    #     kua_number = sum(map(int, str(kua_number))) if kua_number > 9 else kua_number
-    #     kua_number = 9 if kua_number == 0 else (8 if kua_number == 5 else kua_number)
+def get_kua_element(kua_number: int) -> str:
+    return lookup_tables.KUA_ELEMENTS[kua_number]
 
-    return zodiac_animal
 
+def get_zodiac_description(sign: str) -> str:
+    return lookup_tables.ZODIAC_DESCRIPTIONS[lookup_tables.ZODIAC_SIGNS.index(sign)]
 
 
-async def decade_buttons(bot, chat_id, callback_prefix="decade_"):
-    decades = [f"{year}" for year in range(1320, 1420, 10)]
-    markup = create_inline_keyboard(
-        options=decades,
-        columns=2,
-        callback_prefix=callback_prefix
-    )
-    await bot.send_message(
-        chat_id=chat_id,
-        text="لطفاً دهه سال تولد خود را انتخاب کنید:",
-        reply_markup=markup
+
+# Date picker keyboards are built once per (prefix, range) and reused.
+def decade_keyboard(feature):
+    return cached_markup(
+        (feature, "decade", BIRTH_YEARS.start, BIRTH_YEARS.stop),
+        lambda: create_inline_keyboard(
+            options=BIRTH_YEARS[::10],
+            columns=2,
+            callback_data=lambda decade: callback_router.encode(feature, "decade", decade)
+        )
     )
 
 
+def year_keyboard(feature, start_year, end_year):
+    return cached_markup(
+        (feature, "year", start_year, end_year),
+        lambda: create_inline_keyboard(
+            options=range(start_year, end_year + 1),
+            columns=3,
+            callback_data=lambda year: callback_router.encode(feature, "year", year)
+        )
+    )
+
 
-async def year_buttons(bot, chat_id, start_year, end_year, callback_prefix="year_"):
-    years = range(start_year, end_year + 1)
-    markup = create_inline_keyboard(
-        options=years,
-        columns=3,
-        callback_prefix=callback_prefix
+def month_keyboard(feature):
+    return cached_markup(
+        (feature, "month", 1, 12),
+        lambda: create_inline_keyboard(
+            options=range(1, 13),
+            columns=3,
+            labels=PERSIAN_MONTHS,
+            callback_data=lambda month: callback_router.encode(feature, "month", month)
+        )
     )
-    await bot.send_message(
-        chat_id=chat_id, 
-        text="لطفاً سال تولد خود را انتخاب کند:",
-        reply_markup=markup
+
+
+def day_keyboard(feature, days=31):
+    return cached_markup(
+        (feature, "day", 1, days),
+        lambda: create_inline_keyboard(
+            options=range(1, days + 1),
+            columns=3,
+            callback_data=lambda day: callback_router.encode(feature, "day", day)
+        )
     )
 
 
+def gender_keyboard(feature):
+    def build():
+        markup = InlineKeyboardMarkup()
+        markup.add(
+            InlineKeyboardButton("مرد", callback_data=callback_router.encode(feature, "gender", "male")),
+            InlineKeyboardButton("زن", callback_data=callback_router.encode(feature, "gender", "female"))
+        )
+        return markup
+    return cached_markup((feature, "gender"), build)
+
+
+
+async def show_wizard_step(bot, chat_id, text, reply_markup=None, message_id=None):
+    """Send a date picker step, or edit the wizard message when message_id is given."""
+    if message_id is None:
+        return await bot.send_message(
+            chat_id=chat_id,
+            text=text,
+            reply_markup=reply_markup
+        )
+    try:
+        return await bot.edit_message_text(
+            text=text,
+            chat_id=chat_id,
+            message_id=message_id,
+            reply_markup=reply_markup
+        )
+    except ApiTelegramException as e:
+        # A double tap asks for the step already shown.
+        if "message is not modified" not in e.description:
+            raise
+
+
 
-async def month_buttons(bot, chat_id, callback_prefix="month_"):
-    months = range(1, 13)
-    markup = create_inline_keyboard(
-        options=months,
-        columns=3,
-        callback_prefix=callback_prefix
+async def decade_buttons(bot, chat_id, feature, message_id=None, text="لطفاً دهه سال تولد خود را انتخاب کنید:"):
+    await show_wizard_step(
+        bot=bot,
+        chat_id=chat_id,
+        text=text,
+        reply_markup=decade_keyboard(feature=feature),
+        message_id=message_id
     )
-    await bot.send_message(
-        chat_id=chat_id, 
-        text="لطفاً ماه تولد خود را انتخاب کنید:", 
-        reply_markup=markup
+
+
+
+async def year_buttons(bot, chat_id, feature, start_year, end_year, message_id=None):
+    await show_wizard_step(
+        bot=bot,
+        chat_id=chat_id,
+        text="لطفاً سال تولد خود را انتخاب کند:",
+        reply_markup=year_keyboard(
+            feature=feature,
+            start_year=start_year,
+            end_year=end_year
+        ),
+        message_id=message_id
     )
 
 
 
-async def day_buttons(bot, chat_id, callback_prefix="day_"):
-    days = range(1, 32)
-    markup = create_inline_keyboard(
-        options=days,
-        columns=3, 
-        callback_prefix=callback_prefix
+async def month_buttons(bot, chat_id, feature, message_id=None):
+    await show_wizard_step(
+        bot=bot,
+        chat_id=chat_id,
+        text="لطفاً ماه تولد خود را انتخاب کنید:",
+        reply_markup=month_keyboard(feature=feature),
+        message_id=message_id
     )
-    await bot.send_message(
-        chat_id=chat_id, 
+
+
+
+async def day_buttons(bot, chat_id, feature, year, month, message_id=None):
+    await show_wizard_step(
+        bot=bot,
+        chat_id=chat_id,
         text="لطفاً روز تولد خود را انتخاب کنید:",
-        reply_markup=markup
+        reply_markup=day_keyboard(
+            feature=feature,
+            days=persian_month_days(year, month)
+        ),
+        message_id=message_id
     )
 
 
 
-async def gender_buttons(bot, chat_id, callback_prefix="gender_"):
-    markup = InlineKeyboardMarkup()
-    markup.add(
-        InlineKeyboardButton("مرد", callback_data=callback_prefix + "male"),
-        InlineKeyboardButton("زن", callback_data=callback_prefix + "female")
-    )
-    await bot.send_message(
-        chat_id=chat_id, 
+async def gender_buttons(bot, chat_id, feature, message_id=None):
+    await show_wizard_step(
+        bot=bot,
+        chat_id=chat_id,
         text="لطفاً جنسیت خود را انتخاب کنید:",
-        reply_markup=markup
+        reply_markup=gender_keyboard(feature=feature),
+        message_id=message_id
     )
 
 
 
+def current_quota_period(table):
+    """SQL expression for the table's current quota period.
+
+    The period is the feature's epoch, suffixed with the calendar bucket when
+    a window is configured, e.g. "3" or "3:2025-06". /reset bumps the epoch.
+    """
+    bucket = case(
+        (QuotaPeriod.window == "day", func.strftime(":%Y-%m-%d", "now")),
+        (QuotaPeriod.window == "week", func.strftime(":%Y-W%W", "now")),
+        (QuotaPeriod.window == "month", func.strftime(":%Y-%m", "now")),
+        else_=""
+    )
+    period = select(cast(QuotaPeriod.epoch, String) + bucket).where(
+        QuotaPeriod.feature == table.__tablename__
+    ).scalar_subquery()
+    return func.coalesce(period, "0")
+
+
+def increment_visit_count(session, table, user_id, max_calculation, **fields):
+    """Store the result and bump count_visit in one atomic upsert.
+
+    Counts from an older quota period start again from zero, calculations
+    keeps counting across periods. Returns the new count, or None when the user already used up the quota.
+    """
+    period = current_quota_period(table)
+    count_visit = case(
+        (table.quota_period == period, func.coalesce(table.count_visit, 0)),
+        else_=0
+    )
+    stmt = sqlite_insert(table).values(
+        user_id=user_id, count_visit=1, calculations=1, quota_period=period, **fields
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.user_id],
+        set_={
+            **fields,
+            "count_visit": count_visit + 1,
+            "calculations": func.coalesce(table.calculations, 0) + 1,
+            "quota_period": period
+        },
+        where=count_visit < max_calculation
+    ).returning(table.count_visit)
+    return session.exec(stmt).scalar()
+
+
+# The insert_to_* helpers write through the caller's session without
+# committing, they are queued on the write-behind buffer.
 def insert_to_kua_table(
-    engine, user_id, gender, birth_date, kua_number, count_visit
+    session, user_id, gender, birth_date, kua_number, max_calculation
 ):
-    tmp = Kua(
+    return increment_visit_count(
+        session=session,
+        table=Kua,
         user_id=user_id,
+        max_calculation=max_calculation,
         gender=gender,
         birth_date=birth_date,
-        kua_number=kua_number,
-        count_visit=count_visit
+        kua_number=kua_number
     )
-    with Session(engine) as session:
-        session.merge(tmp)
-        session.commit()
 
 
 def insert_to_zodiac_table(
-    engine, user_id, birth_date, chinese_sign, chinese_element, count_visit
+    session, user_id, birth_date, chinese_sign, chinese_element, max_calculation
 ):
-    tmp = Zodiac(
+    return increment_visit_count(
+        session=session,
+        table=Zodiac,
         user_id=user_id,
+        max_calculation=max_calculation,
         birth_date=birth_date,
         chinese_sign=chinese_sign,
-        chinese_element=chinese_element,
-        count_visit=count_visit
+        chinese_element=chinese_element
     )
-    with Session(engine) as session:
-        session.merge(tmp)
-        session.commit()
 
 
 def insert_to_user_table(
-    engine, user_id, username, phone_number, first_name, last_name, given_name, city
+    session, user_id, username, phone_number, first_name, last_name, given_name, city
 ):
     tmp = User(
         user_id=user_id,
@@ -370,9 +535,7 @@ def insert_to_user_table(
         given_name=given_name,
         city=city,
     )
-    with Session(engine) as session:
-        session.merge(tmp)
-        session.commit()
+    session.merge(tmp)
 
 
 def insert_to_mashhad_table(
@@ -389,7 +552,7 @@ def insert_to_mashhad_table(
 
 
 def insert_to_fengshui_test_table(
-    engine, user_id, f_name, l_name, phone, city, metrage, problem
+    session, user_id, f_name, l_name, phone, city, metrage, problem
 ):
     tmp = Fengshui_Test(
         user_id=user_id,
@@ -400,28 +563,50 @@ def insert_to_fengshui_test_table(
         metrage=metrage,
         problem=problem
     )
-    with Session(engine) as session:
-        session.merge(tmp)
-        session.commit()
+    session.merge(tmp)
 
 
 def insert_to_fengshui_score_table(
-    engine, user_id, score
+    session, user_id, score
 ):
     tmp = Fengshui_Score(
         user_id=user_id,
         score=score
     )
+    session.merge(tmp)
+
+
+def insert_to_channel_member_table(
+    engine, user_id, channel, status, ttl=None
+):
+    tmp = ChannelMember(
+        user_id=user_id,
+        channel=channel,
+        status=status,
+        update_date=datetime.datetime.now(datetime.timezone.utc),
+        expires_at=time.time() + ttl if ttl is not None else None
+    )
     with Session(engine) as session:
         session.merge(tmp)
         session.commit()
 
 
+def get_channel_member_status(engine, user_id, channel):
+    with Session(engine) as session:
+        member = session.get(ChannelMember, (user_id, channel))
+        if member is None or (member.expires_at is not None and member.expires_at < time.time()):
+            return None
+        return member.status
+
+
 def check_visit_count(engine, table, user_id, max_calculation):
     with Session(engine) as session:
-        statement = select(table).where(table.user_id == user_id)
-        user = session.exec(statement).first()
-        if user and user.count_visit >= max_calculation:
+        statement = select(table.count_visit).where(
+            table.user_id == user_id,
+            table.quota_period == current_quota_period(table)
+        )
+        count_visit = session.exec(statement).first()
+        if count_visit and count_visit >= max_calculation:
             return False
         return True
 
@@ -435,6 +620,60 @@ def check_register(engine, table, user_id):
         return True
 
 
+def get_user(engine, user_id):
+    with Session(engine) as session:
+        statement = select(User).where(User.user_id == user_id)
+        return session.exec(statement).first()
+
+
+def reset_visit_counts(engine):
+    """Start a new quota period; old counts simply stop matching it."""
+    with Session(engine) as session:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for table in (Kua, Zodiac):
+            stmt = sqlite_insert(QuotaPeriod).values(
+                feature=table.__tablename__,
+                epoch=1,
+                update_date=now
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[QuotaPeriod.feature],
+                set_={"epoch": QuotaPeriod.epoch + 1, "update_date": now}
+            )
+            session.exec(stmt)
+        session.commit()
+
+
+def set_quota_windows(engine, windows):
+    """Store the calendar window ("day", "week", "month" or None) per table."""
+    with Session(engine) as session:
+        for table, window in windows.items():
+            stmt = sqlite_insert(QuotaPeriod).values(
+                feature=table.__tablename__,
+                epoch=0,
+                window=window,
+                update_date=datetime.datetime.now(datetime.timezone.utc)
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[QuotaPeriod.feature],
+                set_={"window": window}
+            )
+            session.exec(stmt)
+        session.commit()
+
+
+def pop_waiting_reply_users(engine):
+    """Clear the legacy reply waiting flags and return the users that had one."""
+    with Session(engine) as session:
+        user_ids = session.exec(
+            select(UserReplyState.user_id).where(UserReplyState.is_waiting)
+        ).all()
+        if user_ids:
+            session.exec(update(UserReplyState).values(is_waiting=False))
+            session.commit()
+        return list(user_ids)
+
+
 def get_all_user_ids(engine, table):
     with Session(engine) as session:
         result = session.exec(text(f"SELECT user_id FROM {table}"))
@@ -455,38 +694,40 @@ def get_all_user_ids(engine, table):
 #             print(f"Failed to send message to {user_id}: {e}")
 
 
-async def forward_message_to_users(
-    engine,
-    bot,
-    from_chat_id,
-    message_id,
-    cities
-):
+def select_broadcast_recipients(cities, members=None):
+    """Users in any of the cities, limited to the `members` select if given."""
     cities = [c.strip() for c in (cities or []) if c.strip()]
-    
-    with Session(engine) as session:
-        stmt = select(User.user_id)
+    statement = select_users_by_cities(cities) if cities else select(User.user_id)
+    if members is not None:
+        statement = statement.where(User.user_id.in_(members))
+    return statement
 
-        if cities:
-            conditions = [User.city.ilike(f"%{c}%") for c in cities]
-            stmt = stmt.where(or_(*conditions))
 
-        user_ids = session.exec(stmt).all()
+def get_given_names(engine, user_ids):
+    with Session(engine) as session:
+        statement = select(User.user_id, User.given_name).where(User.user_id.in_(user_ids))
+        return dict(session.exec(statement).all())
 
-    sent_count = 0
-    for user_id in user_ids:
-        try:
-            await bot.copy_message(
-                user_id,
-                from_chat_id,
-                message_id,
-            )
-            sent_count += 1
-            await asyncio.sleep(0.05)
-        except Exception as e:
-            print(f" مشکل در ارسال پیام برای {user_id}: {e}")
 
-    return sent_count
+async def forward_message_to_users(
+    engine,
+    bot,
+    job,
+    on_progress=None,
+):
+    async def send(user_id):
+        await bot.copy_message(
+            user_id,
+            job.from_chat_id,
+            job.message_id,
+        )
+
+    return await run_broadcast_job(
+        engine=engine,
+        job=job,
+        send=send,
+        on_progress=on_progress
+    )
     
     
     
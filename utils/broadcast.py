@@ -0,0 +1,303 @@
+import time
+import asyncio
+from datetime import datetime, timezone
+from sqlmodel import Session, select, update
+from sqlalchemy import insert, func, literal
+from models import BroadcastJob, BroadcastRecipient
+from utils.database import run_db
+from telebot.asyncio_helper import ApiTelegramException
+
+
+
+# Telegram allows roughly 30 messages per second for bulk notifications.
+DEFAULT_RATE = 25.0
+MAX_RATE = 30.0
+MIN_RATE = 1.0
+DEFAULT_CONCURRENCY = 20
+# 429s are waited out as Telegram asks and are not failures. A recipient
+# still flooded after this many waits is left pending for a later batch.
+MAX_FLOOD_WAITS = 10
+BATCH_SIZE = 200
+
+
+class TokenBucket:
+    """Global send limiter that backs off on 429 and slowly speeds up again."""
+
+    def __init__(self, rate=DEFAULT_RATE, max_rate=MAX_RATE, min_rate=MIN_RATE, increase_step=0.1):
+        self.rate = rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.increase_step = increase_step
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    def on_flood(self, retry_after):
+        now = time.monotonic()
+        # Every request in flight gets a 429 for the same flood window,
+        # only the first one slows the rate down.
+        if now >= self._blocked_until:
+            self.rate = max(self.min_rate, self.rate / 2)
+        self._tokens = 0.0
+        self._blocked_until = max(self._blocked_until, now + retry_after)
+        # No refill for the time spent blocked.
+        self._updated = self._blocked_until
+
+
+# Shared by every broadcast so parallel jobs still respect one global limit.
+telegram_rate_limiter = TokenBucket()
+
+
+class BroadcastStats:
+
+    def __init__(self, total, sent=0, failed=0):
+        self.total = total
+        self.sent = sent
+        self.failed = failed
+        self.started = time.monotonic()
+
+    @property
+    def done(self):
+        return self.sent + self.failed
+
+    def progress_text(self):
+        elapsed = int(time.monotonic() - self.started)
+        return (
+            f"ارسال پیام: {self.done} از {self.total}\n"
+            f"✅ موفق: {self.sent}\n"
+            f"❌ ناموفق: {self.failed}\n"
+            f"⏱ زمان: {elapsed} ثانیه"
+        )
+
+
+def get_retry_after(error):
+    parameters = (error.result_json or {}).get("parameters") or {}
+    return parameters.get("retry_after", 1)
+
+
+async def send_with_retry(send, user_id, bucket, max_flood_waits=MAX_FLOOD_WAITS):
+    """Send to one user, waiting out flood limits.
+
+    Returns True on delivery, False on a failure and None if the user is
+    still flooded after max_flood_waits waits.
+    """
+    for _ in range(max_flood_waits + 1):
+        await bucket.acquire()
+        try:
+            await send(user_id)
+        except ApiTelegramException as e:
+            if e.error_code == 429:
+                bucket.on_flood(get_retry_after(e))
+                continue
+            print(f" مشکل در ارسال پیام برای {user_id}: {e}")
+            return False
+        except Exception as e:
+            print(f" مشکل در ارسال پیام برای {user_id}: {e}")
+            return False
+        bucket.on_success()
+        return True
+    return None
+
+
+async def deliver(user_ids, send, bucket=None, concurrency=DEFAULT_CONCURRENCY):
+    """Deliver `send(user_id)` to a batch of users with a bounded pool of senders.
+
+    Returns the sent, failed and still flooded (deferred) user ids.
+    """
+    bucket = bucket or telegram_rate_limiter
+    queue = asyncio.Queue()
+    for user_id in user_ids:
+        queue.put_nowait(user_id)
+    sent_ids, failed_ids, deferred_ids = [], [], []
+
+    async def sender():
+        while not queue.empty():
+            user_id = queue.get_nowait()
+            delivered = await send_with_retry(send, user_id, bucket)
+            if delivered is None:
+                deferred_ids.append(user_id)
+            elif delivered:
+                sent_ids.append(user_id)
+            else:
+                failed_ids.append(user_id)
+
+    await asyncio.gather(*(sender() for _ in range(min(concurrency, len(user_ids)))))
+    return sent_ids, failed_ids, deferred_ids
+
+
+# ------------------------------------------------------------------------------
+# Persistent Jobs
+# ------------------------------------------------------------------------------
+
+def create_broadcast_job(engine, kind, recipients, admin_chat_id, **fields):
+    """Store a job and snapshot its recipients from the `recipients` select."""
+    with Session(engine) as session:
+        job = BroadcastJob(kind=kind, admin_chat_id=admin_chat_id, **fields)
+        session.add(job)
+        session.flush()
+        recipient_ids = recipients.subquery()
+        session.exec(
+            insert(BroadcastRecipient).from_select(
+                ["job_id", "user_id", "status"],
+                select(literal(job.id), recipient_ids.c.user_id, literal("pending")).distinct()
+            )
+        )
+        job.total = session.exec(
+            select(func.count()).where(BroadcastRecipient.job_id == job.id)
+        ).one()
+        session.commit()
+        session.refresh(job)
+    return job
+
+
+def get_unfinished_broadcast_jobs(engine):
+    with Session(engine) as session:
+        statement = select(BroadcastJob).where(BroadcastJob.status == "running")
+        return session.exec(statement).all()
+
+
+def claim_broadcast_recipients(engine, job_id, batch_size=BATCH_SIZE):
+    with Session(engine) as session:
+        pending = select(BroadcastRecipient.user_id).where(
+            BroadcastRecipient.job_id == job_id,
+            BroadcastRecipient.status == "pending"
+        ).limit(batch_size).scalar_subquery()
+        result = session.exec(
+            update(BroadcastRecipient)
+            .where(
+                BroadcastRecipient.job_id == job_id,
+                BroadcastRecipient.user_id.in_(pending)
+            )
+            .values(status="claimed")
+            .returning(BroadcastRecipient.user_id)
+        )
+        user_ids = [row[0] for row in result]
+        session.commit()
+    return user_ids
+
+
+def release_claimed_recipients(engine, job_id):
+    """Hand a crashed run's in-flight batch back to the pending pool."""
+    with Session(engine) as session:
+        session.exec(
+            update(BroadcastRecipient)
+            .where(
+                BroadcastRecipient.job_id == job_id,
+                BroadcastRecipient.status == "claimed"
+            )
+            .values(status="pending")
+        )
+        session.commit()
+
+
+def record_broadcast_results(engine, job_id, sent_ids, failed_ids, deferred_ids=()):
+    """Store a batch's outcome, deferred recipients go back to pending."""
+    with Session(engine) as session:
+        for status, user_ids in (("sent", sent_ids), ("failed", failed_ids), ("pending", deferred_ids)):
+            if user_ids:
+                session.exec(
+                    update(BroadcastRecipient)
+                    .where(
+                        BroadcastRecipient.job_id == job_id,
+                        BroadcastRecipient.user_id.in_(user_ids)
+                    )
+                    .values(status=status)
+                )
+        session.exec(
+            update(BroadcastJob)
+            .where(BroadcastJob.id == job_id)
+            .values(
+                sent=BroadcastJob.sent + len(sent_ids),
+                failed=BroadcastJob.failed + len(failed_ids)
+            )
+        )
+        session.commit()
+
+
+def finish_broadcast_job(engine, job_id):
+    with Session(engine) as session:
+        session.exec(
+            update(BroadcastJob)
+            .where(BroadcastJob.id == job_id)
+            .values(status="done", finish_date=datetime.now(timezone.utc))
+        )
+        session.commit()
+
+
+async def run_broadcast_job(
+    engine,
+    job,
+    send,
+    prepare_batch=None,
+    on_progress=None,
+    progress_interval=5.0,
+    batch_size=BATCH_SIZE,
+):
+    """Work through a job batch by batch, checkpointing after every batch.
+
+    Only the batch in flight at a crash can be delivered twice on resume.
+    """
+    await run_db(release_claimed_recipients, engine, job.id)
+    stats = BroadcastStats(total=job.total, sent=job.sent, failed=job.failed)
+
+    async def reporter():
+        while True:
+            await asyncio.sleep(progress_interval)
+            await on_progress(stats)
+
+    report_task = asyncio.create_task(reporter()) if on_progress else None
+    try:
+        while True:
+            user_ids = await run_db(claim_broadcast_recipients, engine, job.id, batch_size)
+            if not user_ids:
+                break
+            if prepare_batch:
+                await prepare_batch(user_ids)
+            sent_ids, failed_ids, deferred_ids = await deliver(user_ids, send)
+            await run_db(record_broadcast_results, engine, job.id, sent_ids, failed_ids, deferred_ids)
+            stats.sent += len(sent_ids)
+            stats.failed += len(failed_ids)
+    finally:
+        if report_task:
+            report_task.cancel()
+    await run_db(finish_broadcast_job, engine, job.id)
+    if on_progress:
+        await on_progress(stats)
+    return stats
+
+
+def progress_reporter(bot, chat_id, message_id):
+    """Edit the admin's status message with the current broadcast progress."""
+    async def report(stats):
+        try:
+            await bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=message_id,
+                text=stats.progress_text()
+            )
+        except Exception as e:
+            # Telegram rejects edits that do not change the text.
+            if "message is not modified" not in str(e):
+                print(f"Error Reporting Broadcast Progress: {e}")
+    return report
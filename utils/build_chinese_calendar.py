@@ -0,0 +1,57 @@
+"""Compile the Chinese New Year dates into utils/chinese_new_years.py.
+
+Needs lunardate, which the bot itself does not. Run from the repository
+root after upgrading lunardate:
+
+    python -m utils.build_chinese_calendar
+"""
+import os
+import lunardate
+from importlib.metadata import version
+
+
+
+FIRST_YEAR = 1900
+LAST_YEAR = 2100
+
+UTILS_DIR = os.path.dirname(os.path.abspath(__file__))
+OUTPUT = os.path.join(UTILS_DIR, "chinese_new_years.py")
+
+
+def build_new_year_ordinals(first_year=FIRST_YEAR, last_year=LAST_YEAR):
+    ordinals = []
+    for year in range(first_year, last_year + 1):
+        try:
+            new_year = lunardate.LunarDate(year, 1, 1).toSolarDate()
+        except ValueError:
+            # lunardate stops at the end of its own data
+            break
+        ordinals.append(new_year.toordinal())
+    return ordinals
+
+
+def build():
+    ordinals = build_new_year_ordinals()
+    rows = [
+        "    " + ", ".join(str(ordinal) for ordinal in ordinals[i:i + 8]) + ","
+        for i in range(0, len(ordinals), 8)
+    ]
+    lines = [
+        "# Generated by utils/build_chinese_calendar.py, do not edit.",
+        f"# Source: lunardate {version('lunardate')}",
+        "",
+        f"FIRST_YEAR = {FIRST_YEAR}",
+        "",
+        "# date.toordinal() of Chinese New Year, one per lunar year from FIRST_YEAR.",
+        "NEW_YEAR_ORDINALS = (",
+        *rows,
+        ")",
+        "",
+    ]
+    with open(OUTPUT, "w", encoding="utf-8") as file:
+        file.write("\n".join(lines))
+    print(f"Wrote {OUTPUT}")
+
+
+if __name__ == "__main__":
+    build()
@@ -0,0 +1,90 @@
+"""Compile the JSON datasets in utils/ into utils/lookup_tables.py.
+
+Run from the repository root after editing any of the JSON files:
+
+    python -m utils.build_lookup_tables
+"""
+import os
+import json
+import hashlib
+
+
+
+LOOKUP_TABLES_VERSION = 1
+
+UTILS_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCES = ["kua.json", "zodiac_animal_dataset.json", "zodiac.json", "kua_elements.json"]
+OUTPUT = os.path.join(UTILS_DIR, "lookup_tables.py")
+
+
+def source_digest():
+    digest = hashlib.sha256()
+    for name in SOURCES:
+        with open(os.path.join(UTILS_DIR, name), "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def load(name):
+    with open(os.path.join(UTILS_DIR, name), "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def year_array(values_by_year, encode):
+    """Turn {"1919": v, ...} into (first_year, bytes) with one byte per year."""
+    years = sorted(int(year) for year in values_by_year)
+    if years != list(range(years[0], years[-1] + 1)):
+        raise ValueError("Dataset years are not contiguous")
+    return years[0], bytes(encode(values_by_year[str(year)]) for year in years)
+
+
+def build():
+    kua = load("kua.json")
+    zodiac_animals = load("zodiac_animal_dataset.json")
+    zodiac = load("zodiac.json")
+    kua_elements = load("kua_elements.json")
+
+    kua_first_year, kua_male = year_array(kua["male"], int)
+    female_first_year, kua_female = year_array(kua["female"], int)
+    if female_first_year != kua_first_year or len(kua_female) != len(kua_male):
+        raise ValueError("Male and female kua tables cover different years")
+
+    zodiac_signs = tuple(zodiac)
+    zodiac_first_year, zodiac_years = year_array(zodiac_animals, zodiac_signs.index)
+
+    elements = [None] * 10
+    descriptions = [None] * 10
+    for number, item in kua_elements.items():
+        elements[int(number)] = item["element"]
+        descriptions[int(number)] = item["description"]
+
+    lines = [
+        "# Generated by utils/build_lookup_tables.py, do not edit.",
+        f"# Sources: {', '.join(SOURCES)}",
+        "",
+        f"LOOKUP_TABLES_VERSION = {LOOKUP_TABLES_VERSION}",
+        f"SOURCE_DIGEST = {source_digest()!r}",
+        "",
+        "# One byte per Gregorian year starting at KUA_FIRST_YEAR.",
+        f"KUA_FIRST_YEAR = {kua_first_year}",
+        f"KUA_MALE = {kua_male!r}",
+        f"KUA_FEMALE = {kua_female!r}",
+        "",
+        "# Indexed by kua number, 5 has no entry.",
+        f"KUA_ELEMENTS = {tuple(elements)!r}",
+        f"KUA_ELEMENT_DESCRIPTIONS = {tuple(descriptions)!r}",
+        "",
+        "# One byte per Gregorian year starting at ZODIAC_FIRST_YEAR, indexing ZODIAC_SIGNS.",
+        f"ZODIAC_FIRST_YEAR = {zodiac_first_year}",
+        f"ZODIAC_YEARS = {zodiac_years!r}",
+        f"ZODIAC_SIGNS = {zodiac_signs!r}",
+        f"ZODIAC_DESCRIPTIONS = {tuple(zodiac[sign]['description'] for sign in zodiac_signs)!r}",
+        "",
+    ]
+    with open(OUTPUT, "w", encoding="utf-8") as file:
+        file.write("\n".join(lines))
+    print(f"Wrote {OUTPUT}")
+
+
+if __name__ == "__main__":
+    build()
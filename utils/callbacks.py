@@ -0,0 +1,157 @@
+import hmac
+import base64
+import hashlib
+import secrets
+from sqlmodel import Session
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import Secret
+
+
+
+# Bump when the payload layout changes, older buttons are then answered as
+# expired instead of being misread.
+CALLBACK_VERSION = "1"
+
+FEATURE_CODES = {
+    "kua": "k",
+    "zodiac": "z",
+    "poll": "p",
+    "reply": "r",
+}
+
+STEP_CODES = {
+    "decade": "d",
+    "year": "y",
+    "month": "m",
+    "day": "D",
+    "gender": "g",
+    "answer": "a",
+    "user": "u",
+}
+
+SIGNATURE_SEPARATOR = "~"
+SIGNATURE_BYTES = 6
+
+# callback_data before signed payloads. Buttons still carrying them are
+# answered as expired unless a handler is registered with prefix().
+LEGACY_PREFIXES = ["kua_", "zodiac_", "poll_", "reply_"]
+
+
+def get_or_create_secret(engine, name="callback"):
+    """Return the stored secret, generating it on first use.
+
+    Kept in the database so every worker process and restart signs with
+    the same key, independent of the bot token.
+    """
+    statement = sqlite_insert(Secret).values(
+        name=name, value=secrets.token_urlsafe(32)
+    ).on_conflict_do_nothing(index_elements=["name"])
+    with Session(engine) as session:
+        session.exec(statement)
+        session.commit()
+        return session.get(Secret, name).value
+
+
+class CallbackRouter:
+    """Dispatches callback queries in a single pass over call.data.
+
+    Parameterized buttons carry "<version><feature><step><value>~<signature>",
+    e.g. "1ky1370~q1Xc0a9B", signed with an HMAC so forged or outdated data
+    is rejected before any handler runs. Fixed buttons (the dashboard etc.)
+    are matched exactly and LEGACY_PREFIXES are recognized as stale, both
+    through a prefix trie.
+    """
+
+    def __init__(self, secret=None):
+        self._key = None
+        self._routes = {}
+        self._trie = {}
+        if secret:
+            self.set_secret(secret)
+        for prefix in LEGACY_PREFIXES:
+            self._add_prefix(prefix, None, exact=False)
+
+    def set_secret(self, secret):
+        self._key = hashlib.sha256(b"callback:" + secret.encode()).digest()
+
+    def _sign(self, payload):
+        digest = hmac.new(self._key, payload.encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest[:SIGNATURE_BYTES]).decode()
+
+    def encode(self, feature, step, value=""):
+        payload = f"{CALLBACK_VERSION}{FEATURE_CODES[feature]}{STEP_CODES[step]}{value}"
+        return f"{payload}{SIGNATURE_SEPARATOR}{self._sign(payload)}"
+
+    def route(self, feature, step):
+        """Register handler(call, value) for payloads built by encode(feature, step, ...)."""
+        code = FEATURE_CODES[feature] + STEP_CODES[step]
+
+        def decorator(handler):
+            if code in self._routes:
+                raise ValueError(f"Callback {feature}/{step} already has a handler")
+            self._routes[code] = handler
+            return handler
+        return decorator
+
+    def literal(self, *values):
+        """Register handler(call) for buttons whose callback_data is a fixed string."""
+        def decorator(handler):
+            for value in values:
+                self._add_prefix(value, handler, exact=True)
+            return handler
+        return decorator
+
+    def prefix(self, *prefixes):
+        """Register handler(call) for every callback_data starting with a prefix."""
+        def decorator(handler):
+            for prefix in prefixes:
+                self._add_prefix(prefix, handler, exact=False)
+            return handler
+        return decorator
+
+    def _add_prefix(self, prefix, handler, exact):
+        node = self._trie
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node["exact" if exact else "prefix"] = handler
+
+    def _match_prefix(self, data):
+        """Handler of the exact route for data, else of its longest registered prefix."""
+        node = self._trie
+        handler = None
+        for char in data:
+            handler = node.get("prefix", handler)
+            node = node.get(char)
+            if node is None:
+                return handler
+        return node.get("exact", node.get("prefix", handler))
+
+    def decode(self, data):
+        """Return (code, value) of a valid signed payload, or None."""
+        if not data or data[0] != CALLBACK_VERSION or self._key is None:
+            return None
+        payload, separator, signature = data.rpartition(SIGNATURE_SEPARATOR)
+        if not separator or len(payload) < 3:
+            return None
+        if not hmac.compare_digest(signature, self._sign(payload)):
+            return None
+        return payload[1:3], payload[3:]
+
+    async def dispatch(self, call):
+        """Run the handler for call.data and return False if there is none."""
+        decoded = self.decode(call.data)
+        if decoded is not None:
+            code, value = decoded
+            handler = self._routes.get(code)
+            if handler is None:
+                return False
+            await handler(call, value)
+            return True
+        handler = self._match_prefix(call.data or "")
+        if handler is None:
+            return False
+        await handler(call)
+        return True
+
+
+callback_router = CallbackRouter()
@@ -0,0 +1,25 @@
+"""Chinese (lunar) year lookup through a table of Chinese New Year dates.
+
+The table is compiled into utils/chinese_new_years.py by
+utils/build_chinese_calendar.py; lookups are a bisect over 200 ordinals
+instead of a lunardate conversion per request.
+"""
+import bisect
+import datetime
+from utils.chinese_new_years import FIRST_YEAR, NEW_YEAR_ORDINALS
+
+
+
+# The shortest lunar year has 353 days, so no date before this many days
+# after the last New Year can belong to the following year.
+MIN_LUNAR_YEAR_DAYS = 353
+
+LAST_ORDINAL = NEW_YEAR_ORDINALS[-1] + MIN_LUNAR_YEAR_DAYS - 1
+
+
+def chinese_year(year, month, day):
+    """Lunar year of a Gregorian date."""
+    ordinal = datetime.date(year, month, day).toordinal()
+    if not NEW_YEAR_ORDINALS[0] <= ordinal <= LAST_ORDINAL:
+        raise ValueError(f"{year}-{month}-{day} is outside the Chinese calendar table")
+    return FIRST_YEAR + bisect.bisect_right(NEW_YEAR_ORDINALS, ordinal) - 1
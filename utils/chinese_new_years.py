@@ -0,0 +1,33 @@
+# Generated by utils/build_chinese_calendar.py, do not edit.
+# Source: lunardate 0.2.2
+
+FIRST_YEAR = 1900
+
+# date.toordinal() of Chinese New Year, one per lunar year from FIRST_YEAR.
+NEW_YEAR_ORDINALS = (
+    693626, 694010, 694364, 694719, 695102, 695456, 695811, 696195,
+    696549, 696904, 697288, 697642, 698026, 698380, 698734, 699118,
+    699472, 699827, 700211, 700566, 700950, 701304, 701658, 702042,
+    702396, 702750, 703135, 703489, 703844, 704228, 704582, 704965,
+    705319, 705674, 706058, 706413, 706767, 707151, 707505, 707889,
+    708243, 708597, 708981, 709336, 709690, 710075, 710429, 710783,
+    711167, 711521, 711905, 712259, 712614, 712998, 713352, 713707,
+    714091, 714445, 714828, 715183, 715537, 715921, 716276, 716630,
+    717014, 717369, 717722, 718106, 718461, 718845, 719199, 719554,
+    719938, 720292, 720646, 721030, 721384, 721768, 722122, 722477,
+    722861, 723216, 723570, 723954, 724308, 724692, 725046, 725400,
+    725784, 726139, 726494, 726878, 727232, 727586, 727969, 728324,
+    728708, 729062, 729417, 729801, 730155, 730509, 730893, 731247,
+    731602, 731986, 732340, 732725, 733079, 733433, 733817, 734171,
+    734525, 734909, 735264, 735648, 736002, 736357, 736741, 737095,
+    737449, 737833, 738187, 738542, 738926, 739280, 739664, 740018,
+    740372, 740756, 741111, 741465, 741849, 742204, 742588, 742942,
+    743296, 743680, 744034, 744388, 744772, 745127, 745482, 745866,
+    746220, 746604, 746958, 747312, 747696, 748050, 748405, 748789,
+    749144, 749528, 749882, 750236, 750619, 750974, 751328, 751712,
+    752067, 752421, 752805, 753159, 753543, 753897, 754252, 754636,
+    754990, 755345, 755729, 756083, 756467, 756821, 757175, 757559,
+    757914, 758268, 758652, 759007, 759361, 759745, 760099, 760483,
+    760837, 761192, 761576, 761930, 762285, 762668, 763022, 763406,
+    763760, 764115, 764499, 764854, 765208, 765592, 765946, 766300,
+)
@@ -0,0 +1,74 @@
+from sqlalchemy import or_, text, table, column
+from sqlmodel import select
+from models import User
+
+
+
+CITY_INDEX_TABLE = "user_city_index"
+
+# Trigram queries need at least three characters; shorter keywords fall
+# back to a LIKE scan.
+MIN_TERM_LENGTH = 3
+
+# The FTS5 table mirrors user.city (external content keyed by user_id) and
+# the triggers keep it in sync with every write to the user table.
+CITY_INDEX_DDL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {CITY_INDEX_TABLE} USING fts5(
+        city, content='user', content_rowid='user_id', tokenize='trigram'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {CITY_INDEX_TABLE}_ai AFTER INSERT ON "user" BEGIN
+        INSERT INTO {CITY_INDEX_TABLE}(rowid, city) VALUES (new.user_id, new.city);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {CITY_INDEX_TABLE}_ad AFTER DELETE ON "user" BEGIN
+        INSERT INTO {CITY_INDEX_TABLE}({CITY_INDEX_TABLE}, rowid, city) VALUES ('delete', old.user_id, old.city);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {CITY_INDEX_TABLE}_au AFTER UPDATE OF city ON "user" BEGIN
+        INSERT INTO {CITY_INDEX_TABLE}({CITY_INDEX_TABLE}, rowid, city) VALUES ('delete', old.user_id, old.city);
+        INSERT INTO {CITY_INDEX_TABLE}(rowid, city) VALUES (new.user_id, new.city);
+    END
+    """,
+]
+
+
+def create_city_index(engine):
+    """Create the city search index, building it from existing users once."""
+    with engine.begin() as connection:
+        exists = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = :name"),
+            {"name": CITY_INDEX_TABLE}
+        ).first()
+        for statement in CITY_INDEX_DDL:
+            connection.execute(text(statement))
+        if not exists:
+            print("Building city search index ...")
+            connection.execute(
+                text(f"INSERT INTO {CITY_INDEX_TABLE}({CITY_INDEX_TABLE}) VALUES ('rebuild')")
+            )
+
+
+def city_match_query(keywords):
+    # Each keyword is a quoted phrase, so it matches as a plain substring.
+    return " OR ".join('"' + keyword.replace('"', '""') + '"' for keyword in keywords)
+
+
+def select_users_by_cities(cities):
+    long_keywords = [c for c in cities if len(c) >= MIN_TERM_LENGTH]
+    short_keywords = [c for c in cities if len(c) < MIN_TERM_LENGTH]
+    conditions = []
+    if long_keywords:
+        index = table(CITY_INDEX_TABLE, column("rowid"))
+        matched = select(index.c.rowid).where(
+            text(f"{CITY_INDEX_TABLE} MATCH :city_query").bindparams(
+                city_query=city_match_query(long_keywords)
+            )
+        )
+        conditions.append(User.user_id.in_(matched))
+    conditions += [User.city.ilike(f"%{c}%") for c in short_keywords]
+    return select(User.user_id).where(or_(*conditions))
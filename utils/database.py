@@ -0,0 +1,111 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import event, inspect
+from sqlmodel import create_engine, text
+
+
+
+# SQLite serializes writers anyway, a few threads are enough to keep
+# slow queries off the event loop without piling up connections.
+DB_MAX_WORKERS = 4
+
+db_executor = ThreadPoolExecutor(
+    max_workers=DB_MAX_WORKERS,
+    thread_name_prefix="db"
+)
+
+
+async def run_db(func, *args, **kwargs):
+    """Run a blocking database helper on the DB executor and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        db_executor,
+        functools.partial(func, *args, **kwargs)
+    )
+
+
+# Applied to every new connection. WAL lets readers run next to the
+# single writer and synchronous=NORMAL (1) only fsyncs at checkpoints,
+# which is safe in WAL mode.
+SQLITE_PRAGMAS = {
+    "journal_mode": "wal",
+    "synchronous": 1,
+    "busy_timeout": 5000,
+    "cache_size": -64000,
+    "temp_store": 2,  # MEMORY
+    "mmap_size": 268435456,
+}
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+def create_database_engine(database_name):
+    engine = create_engine(
+        f"sqlite:///{database_name}",
+        # One connection per DB thread plus one for the event loop thread.
+        pool_size=DB_MAX_WORKERS + 1,
+        max_overflow=2,
+        pool_timeout=30,
+        connect_args={"timeout": 30, "check_same_thread": False},
+    )
+    event.listen(engine, "connect", set_sqlite_pragmas)
+    return engine
+
+
+def rename_tables(engine, renames):
+    """Rename tables whose model now uses another name, run before create_all.
+
+    A table is only renamed while the new name does not exist yet, so the
+    existing rows are kept instead of create_all adding an empty table.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for old_name, new_name in renames.items():
+            if inspector.has_table(old_name) and not inspector.has_table(new_name):
+                print(f"Renaming table {old_name} to {new_name}")
+                connection.execute(text(f'ALTER TABLE "{old_name}" RENAME TO "{new_name}"'))
+
+
+def add_missing_columns(engine, metadata):
+    """Add columns introduced after a table was first created.
+
+    create_all only creates missing tables, so new model fields on existing
+    tables are added here with their server default.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                default = ""
+                if column.server_default is not None:
+                    default = f" DEFAULT '{column.server_default.arg}'"
+                print(f"Adding column {table.name}.{column.name}")
+                connection.execute(text(
+                    f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}{default}'
+                ))
+
+
+def check_database_settings(engine):
+    """Print the pragmas in effect and warn about any that did not apply."""
+    settings = {}
+    with engine.connect() as connection:
+        for name in SQLITE_PRAGMAS:
+            settings[name] = connection.execute(text(f"PRAGMA {name}")).scalar()
+    for name, value in settings.items():
+        expected = SQLITE_PRAGMAS[name]
+        if str(value).lower() != str(expected):
+            print(f"Database setting {name}={value}, expected {expected}")
+    print("Database settings:", ", ".join(f"{k}={v}" for k, v in settings.items()))
+    return settings
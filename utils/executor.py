@@ -0,0 +1,100 @@
+import asyncio
+from collections import deque
+from telebot.async_telebot import AsyncTeleBot
+
+
+
+# Updates handled at once across all users. Handlers mostly wait on the
+# Telegram API, so this is well above the core count.
+DEFAULT_CONCURRENCY = 100
+
+
+def update_key(update):
+    """The user or chat an update belongs to, updates with the same key run in order."""
+    if update.message:
+        return update.message.chat.id
+    if update.edited_message:
+        return update.edited_message.chat.id
+    if update.callback_query:
+        if update.callback_query.message:
+            return update.callback_query.message.chat.id
+        return update.callback_query.from_user.id
+    if update.chat_member:
+        return update.chat_member.new_chat_member.user.id
+    if update.my_chat_member:
+        return update.my_chat_member.chat.id
+    # Nothing to order against
+    return ("update", update.update_id)
+
+
+class UpdateExecutor:
+    """Runs one user's updates one after another and different users concurrently.
+
+    Each key with pending updates has a single worker task draining its
+    queue, and a semaphore bounds how many updates run at once overall.
+    """
+
+    def __init__(self, process, max_concurrency=DEFAULT_CONCURRENCY):
+        self.process = process
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+        self._queues = {}
+        self._workers = set()
+
+    def submit(self, update):
+        """Queue an update and return a future resolved once it was handled."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        future = asyncio.get_running_loop().create_future()
+        key = update_key(update)
+        queue = self._queues.get(key)
+        if queue is not None:
+            queue.append((update, future))
+            return future
+        self._queues[key] = deque([(update, future)])
+        worker = asyncio.create_task(self._drain(key))
+        self._workers.add(worker)
+        worker.add_done_callback(self._workers.discard)
+        return future
+
+    async def _drain(self, key):
+        queue = self._queues[key]
+        try:
+            while queue:
+                update, future = queue.popleft()
+                try:
+                    async with self._semaphore:
+                        await self.process([update])
+                except Exception as e:
+                    print(f"Error handling update {update.update_id}: {e}")
+                finally:
+                    if not future.done():
+                        future.set_result(None)
+        finally:
+            del self._queues[key]
+
+    async def run(self, updates):
+        await asyncio.gather(*(self.submit(update) for update in updates))
+
+    @property
+    def pending(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def join(self):
+        """Wait until every queued update has been handled."""
+        while self._workers:
+            await asyncio.gather(*self._workers, return_exceptions=True)
+
+
+class OrderedAsyncTeleBot(AsyncTeleBot):
+    """AsyncTeleBot whose updates go through an UpdateExecutor."""
+
+    def __init__(self, *args, max_concurrency=DEFAULT_CONCURRENCY, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.update_executor = UpdateExecutor(
+            process=super().process_new_updates,
+            max_concurrency=max_concurrency
+        )
+
+    async def process_new_updates(self, updates):
+        await self.update_executor.run(updates)
@@ -0,0 +1,60 @@
+import os
+import csv
+import gzip
+import json
+import tempfile
+from sqlmodel import select
+from models import User, Kua, Zodiac, Fengshui_Test, Fengshui_Score
+
+
+
+EXPORT_TABLES = {
+    "users": User,
+    "kua": Kua,
+    "zodiac": Zodiac,
+    "fengshui_test": Fengshui_Test,
+    "fengshui_score": Fengshui_Score,
+}
+EXPORT_FORMATS = ("csv", "jsonl")
+
+# Rows fetched from the cursor at a time, memory use does not grow with
+# the table.
+CHUNK_SIZE = 1000
+
+
+def export_table(engine, name, export_format="csv", chunk_size=CHUNK_SIZE):
+    """Write a table to a gzipped temporary file, return (path, row count).
+
+    The caller removes the file once it has been sent.
+    """
+    table = EXPORT_TABLES[name]
+    columns = list(table.__table__.columns)
+    names = [column.name for column in columns]
+    descriptor, path = tempfile.mkstemp(prefix=f"{name}_", suffix=f".{export_format}.gz")
+    count = 0
+    try:
+        # utf-8-sig so spreadsheet apps read the Persian text correctly
+        encoding = "utf-8-sig" if export_format == "csv" else "utf-8"
+        with os.fdopen(descriptor, "wb") as raw, \
+                gzip.open(raw, "wt", encoding=encoding, newline="") as file:
+            writer = csv.writer(file) if export_format == "csv" else None
+            if writer:
+                writer.writerow(names)
+            with engine.connect() as connection:
+                result = connection.execution_options(
+                    stream_results=True,
+                    yield_per=chunk_size
+                ).execute(select(*columns))
+                for rows in result.partitions():
+                    if writer:
+                        writer.writerows(rows)
+                    else:
+                        file.writelines(
+                            json.dumps(dict(zip(names, row)), ensure_ascii=False, default=str) + "\n"
+                            for row in rows
+                        )
+                    count += len(rows)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, count
@@ -0,0 +1,140 @@
+"""Array versions of the converters in utils/jalali.py.
+
+Same arithmetic as jalali.Persian and jalali.Gregorian, including the float
+truncations, applied to whole NumPy arrays at once. They are checked
+against the scalar classes in tests/test_jalali_batch.py and timed by
+benchmarks/jalali_batch.py.
+"""
+import numpy as np
+
+
+
+# Day of year before each Gregorian month, indexed by month (1-12).
+GREGORIAN_DAYS_BEFORE = np.array([0, 0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334])
+
+GREGORIAN_MONTH_DAYS = np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+# Last day of year of each Gregorian month, as used by Persian(): a year
+# divisible by 4 is always leap here.
+GREGORIAN_MONTH_ENDS = np.array([
+    np.cumsum([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]),
+    np.cumsum([31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]),
+])
+
+
+def as_arrays(years, months, days):
+    years, months, days = np.broadcast_arrays(
+        np.asarray(years, dtype=np.int64),
+        np.asarray(months, dtype=np.int64),
+        np.asarray(days, dtype=np.int64),
+    )
+    return years, months, days
+
+
+def truncate(values):
+    """int() of each value, i.e. rounding toward zero."""
+    return np.trunc(values).astype(np.int64)
+
+
+def valid_persian_dates(years, months, days):
+    """Mask of the dates jalali.Persian accepts."""
+    years, months, days = as_arrays(years, months, days)
+    return (
+        (years >= 1) & (months >= 1) & (months <= 12) & (days >= 1) & (days <= 31)
+        & ~((months > 6) & (days == 31))
+    )
+
+
+def valid_gregorian_dates(years, months, days):
+    """Mask of the dates jalali.Gregorian accepts (real calendar dates)."""
+    years, months, days = as_arrays(years, months, days)
+    valid = (years >= 1) & (years <= 9999) & (months >= 1) & (months <= 12) & (days >= 1)
+    leap = (years % 4 == 0) & ((years % 100 != 0) | (years % 400 == 0))
+    month_days = GREGORIAN_MONTH_DAYS[np.where(valid, months, 0)] + (leap & (months == 2))
+    return valid & (days <= month_days)
+
+
+def persian_to_gregorian(years, months, days):
+    """Batch jalali.Persian(...).gregorian_tuple(), as three int64 arrays."""
+    years, months, days = as_arrays(years, months, days)
+    if not valid_persian_dates(years, months, days).all():
+        raise ValueError("Incorrect Date")
+
+    d_4 = (years + 1) % 4
+    doy_j = np.where(months < 7, (months - 1) * 31 + days, (months - 7) * 30 + days + 186)
+    d_33 = truncate(((years - 55) % 132) * .0305)
+    a = np.where((d_33 != 3) & (d_4 <= d_33), 287, 286)
+    b = np.where(
+        ((d_33 == 1) | (d_33 == 2)) & ((d_33 == d_4) | (d_4 == 1)),
+        78,
+        np.where((d_33 == 3) & (d_4 == 0), 80, 79)
+    )
+    shifted = truncate((years - 19) / 63) == 20
+    a = a - shifted
+    b = b + shifted
+
+    first_part = doy_j <= a
+    gy = np.where(first_part, years + 621, years + 622)
+    gd = np.where(first_part, doy_j + b, doy_j - a)
+
+    month_ends = GREGORIAN_MONTH_ENDS[(gy % 4 == 0).astype(np.int64)]
+    month_index = (gd[..., None] > month_ends).sum(axis=-1)
+    gm = month_index + 1
+    days_before = np.where(
+        month_index > 0,
+        np.take_along_axis(month_ends, np.maximum(month_index - 1, 0)[..., None], axis=-1)[..., 0],
+        0
+    )
+    return gy, gm, gd - days_before
+
+
+def gregorian_to_persian(years, months, days):
+    """Batch jalali.Gregorian(...).persian_tuple(), as three int64 arrays."""
+    years, months, days = as_arrays(years, months, days)
+    if not valid_gregorian_dates(years, months, days).all():
+        raise ValueError("Invalid Date")
+
+    d_4 = years % 4
+    doy_g = GREGORIAN_DAYS_BEFORE[months] + days + ((d_4 == 0) & (months > 2))
+    d_33 = truncate(((years - 16) % 132) * .0305)
+    a = np.where((d_33 == 3) | (d_33 < (d_4 - 1)) | (d_4 == 0), 286, 287)
+    b = np.where(
+        ((d_33 == 1) | (d_33 == 2)) & ((d_33 == d_4) | (d_4 == 1)),
+        78,
+        np.where((d_33 == 3) & (d_4 == 0), 80, 79)
+    )
+    shifted = truncate((years - 10) / 63) == 30
+    a = a - shifted
+    b = b + shifted
+
+    after_new_year = doy_g > b
+    jy = np.where(after_new_year, years - 621, years - 622)
+    doy_j = np.where(after_new_year, doy_g - b, doy_g + a)
+
+    first_half = doy_j < 187
+    jm_first = truncate((doy_j - 1) / 31)
+    jm_second = truncate((doy_j - 187) / 30)
+    jm = np.where(first_half, jm_first + 1, jm_second + 7)
+    jd = np.where(first_half, doy_j - 31 * jm_first, doy_j - 186 - jm_second * 30)
+    return jy, jm, jd
+
+
+def persian_dates(first_year, last_year):
+    """Every date Persian() accepts in the given years, as three arrays."""
+    years, months, days = np.meshgrid(
+        np.arange(first_year, last_year + 1), np.arange(1, 13), np.arange(1, 32), indexing="ij"
+    )
+    years, months, days = years.ravel(), months.ravel(), days.ravel()
+    valid = valid_persian_dates(years, months, days)
+    return years[valid], months[valid], days[valid]
+
+
+def gregorian_dates(first_year, last_year):
+    """Every real calendar date in the given Gregorian years, as three arrays."""
+    first = np.datetime64(f"{first_year:04d}-01-01")
+    last = np.datetime64(f"{last_year + 1:04d}-01-01")
+    dates = np.arange(first, last, dtype="datetime64[D]")
+    years = dates.astype("datetime64[Y]").astype(np.int64) + 1970
+    months = dates.astype("datetime64[M]").astype(np.int64) % 12 + 1
+    days = (dates - dates.astype("datetime64[M]")).astype(np.int64) + 1
+    return years, months, days
@@ -0,0 +1,30 @@
+from telebot.types import JsonSerializable
+
+
+
+class FrozenMarkup(JsonSerializable):
+    """A reply markup serialized once and shared by every send.
+
+    telebot only calls to_json() on reply_markup, so the cached string goes
+    straight into the request. Build a new markup instead of changing one.
+    """
+
+    __slots__ = ("markup", "json")
+
+    def __init__(self, markup):
+        self.markup = markup
+        self.json = markup.to_json()
+
+    def to_json(self):
+        return self.json
+
+
+_markups = {}
+
+
+def cached_markup(key, build):
+    """Return the frozen markup for key, building it on first use."""
+    markup = _markups.get(key)
+    if markup is None:
+        markup = _markups[key] = FrozenMarkup(build())
+    return markup
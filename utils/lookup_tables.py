@@ -0,0 +1,20 @@
+# Generated by utils/build_lookup_tables.py, do not edit.
+# Sources: kua.json, zodiac_animal_dataset.json, zodiac.json, kua_elements.json
+
+LOOKUP_TABLES_VERSION = 1
+SOURCE_DIGEST = 'c77ce252b9acdc0027bd99888fa16aff97c6b6a51da5441a24a36925e6fd40ee'
+
+# One byte per Gregorian year starting at KUA_FIRST_YEAR.
+KUA_FIRST_YEAR = 1919
+KUA_MALE = b'\t\x08\x07\x06\x02\x04\x03\x02\x01\t\x08\x07\x06\x02\x04\x03\x02\x01\t\x08\x07\x06\x02\x04\x03\x02\x01\t\x08\x07\x06\x02\x04\x03\x02\x01\t\x08\x07\x06\x02\x04\x03\x02\x01\t\x08\x07\x06\x02\x04\x03\x02\x01\t\x08\x07\x06\x02\x04\x03\x02\x01\t\x08\x07\x06\x02\x04\x03\x02\x01\t\x08\x07\x06\x02\x04\x03\x02\x01\t\x08\x07\x06\x02\x04\x03\x02\x01\t\x08\x07\x06\x02\x04\x03\x02\x01\t\x08\x07\x06\x02\x04\x03\x02\x01\t\x08\x07\x06\x02\x04\x03\x02\x01\t\x08\x07\x06\x02\x04\x03\x02\x01\t\x08\x07\x06\x02\x04\x03\x02\x01'
+KUA_FEMALE = b'\x06\x07\x08\t\x01\x02\x03\x04\x08\x06\x07\x08\t\x01\x02\x03\x04\x08\x06\x07\x08\t\x01\x02\x03\x04\x08\x06\x07\x08\t\x01\x02\x03\x04\x08\x06\x07\x08\t\x01\x02\x03\x04\x08\x06\x07\x08\t\x01\x02\x03\x04\x08\x06\x07\x08\t\x01\x02\x03\x04\x08\x06\x07\x08\t\x01\x02\x03\x04\x08\x06\x07\x08\t\x01\x02\x03\x04\x08\x06\x07\x08\t\x01\x02\x03\x04\x08\x06\x07\x08\t\x01\x02\x03\x04\x08\x06\x07\x08\t\x01\x02\x03\x04\x08\x06\x07\x08\t\x01\x02\x03\x04\x08\x06\x07\x08\t\x01\x02\x03\x04\x08\x06\x07\x08\t\x01\x02\x03\x04\x08'
+
+# Indexed by kua number, 5 has no entry.
+KUA_ELEMENTS = (None, 'آب', 'خاک', 'چوب', 'چوب', None, 'فلز', 'فلز', 'خاک', 'آتش')
+KUA_ELEMENT_DESCRIPTIONS = (None, 'پاکسازی با آب و نمک و سرکه - آب و گلاب - دوش آب و\u200cنمک - صدای جریان آب  (رودخانه - دریا - آبنما)', 'سنگ نمک - سنگهای انرژیتیک - لمس خاک  و\u200c ماسه - پیاده روی بدون کفش روی  زمین', 'کاشت و پرورش گیاهان - لمس گلبرگ گلها - سوزاندن گیاهان معطر (اسماج - پالوسانتو - چوب دارچین)', 'کاشت و پرورش گیاهان - لمس گلبرگ گلها - سوزاندن گیاهان معطر (اسماج - پالوسانتو - چوب دارچین)', None, 'کاسه تبتی - صدای زنگوله یا بادزنگ فلزی', 'کاسه تبتی - صدای زنگوله یا بادزنگ فلزی', 'سنگ نمک - سنگهای انرژیتیک - لمس خاک  و\u200c ماسه - پیاده روی بدون کفش روی  زمین', 'استفاده از نور طبیعی خورشید - روشن کردن شمع و عود')
+
+# One byte per Gregorian year starting at ZODIAC_FIRST_YEAR, indexing ZODIAC_SIGNS.
+ZODIAC_FIRST_YEAR = 1912
+ZODIAC_YEARS = b'\x04\x05\x06\x07\x08\t\n\x0b\x00\x01\x02\x03\x04\x05\x06\x07\x08\t\n\x0b\x00\x01\x02\x03\x04\x05\x06\x07\x08\t\n\x0b\x00\x01\x02\x03\x04\x05\x06\x07\x08\t\n\x0b\x00\x01\x02\x03\x04\x05\x06\x07\x08\t\n\x0b\x00\x01\x02\x03\x04\x05\x06\x07\x08\t\n\x0b\x00\x01\x02\x03\x04\x05\x06\x07\x08\t\n\x0b\x00\x01\x02\x03\x04\x05\x06\x07\x08\t\n\x0b\x00\x01\x02\x03\x04\x05\x06\x07\x08\t\n\x0b\x00\x01\x02\x03\x04\x05\x06\x07\x08\t\n\x0b\x00\x01\x02\x03\x04\x05\x06\x07\x08\t\n\x0b\x00\x01\x02\x03'
+ZODIAC_SIGNS = ('Monkey', 'Rooster', 'Dog', 'Pig', 'Rat', 'Ox', 'Tiger', 'Rabbit', 'Dragon', 'Snake', 'Horse', 'Goat')
+ZODIAC_DESCRIPTIONS = ('متولدین سال میمون 🐒\n\nمخترع، محرک، بداهه گو، تیزهوش، کنجکاو، کنجکاو، انعطاف\u200cپذیر، نوآور، حلال مشکلات، به خود مطمئن، اجتماعی وخوش مشرب، هنرمند، مودب، با وقار، رقابتی، هدفمند، واقع بین و خردمند. این افراد بعضی اوقات خودبین، خودخواه، بی ملاحظه، مغرور، گمراه کننده، حیله گر، حسود و مشکوک هستند.', 'متولدین سال خروس 🐓\n\nحساس، شسته رفته، دقیق، با برنامه، به خود مطمئن، قاطع، محافظه کار، منتقد، کمال گرا، محتاط، متعصب، عمل گرا، علاقمند به علم و مسئول. متولدین سال خروس گاهی خرافاتی و بیش از حد ایرادگیر، خشکه مقدس، خودخواه، لجوج و بیش از حد به خود مطمئن می\u200cشوند.', 'متولدین سال سگ 🐕\u200d🦺\n\nصادق، هوشمند، صریح، وفادار، سرشار از حس عدالت خواهی و منصف، جذاب، دوست داشتنی، بی تکلف، اجتماعی، روشن فکر، ایده آلیست و آرمان گرا، با اخلاق، عمل گرا، مهربان، حساس، آسان گیر. این افراد گاهی خیره سر، تنبل، سرد، بدبین، جنگجو، لجوج و ستیزه جو هستند.', 'متولدین سال خوک 🐖\n\nصادق، شجاع، محکم، خوش مشرب، صلح دوست، صبور، وفادار، سخت کوش، معتمد، صادق، خونسرد، فهیم، متفکر، وسواسی، پرشور، با هوش. این افراد گاهی ساده لوح، جبرگرا و مادی می\u200cشوند.', 'متولدین سال موش 🐁\n\nصریح، سرسخت، محکم، دقیق کاریزماتیک، حساس، سخت کوش، جذاب، اجتماعی، هنرمند، زیرک. متولد سال موش گاهی می\u200cتواند با دقت شرایط را تحت کنترل قرار دهد. آنها گاهی می توانند کینه جو، خود مخرب، دروغگو، پول پرست، لجوج، منتقد، بیش از حد بلند پرواز، بی رحم، متعصب و فریبنده باشد. ', 'متولدین سال گاو 🐂\n\nقابل اعتماد، بلند پرواز، خونسرد، هدفمند، متولد این ماه رهبر به دنیا آمده، صبور، سخت کوش، پیرو سنت و آداب و رسوم، ثابت و استوار، متواضع، منطقی، مصمم، محکم و با اراده هستند. متولد این سال گاهی می\u200cتواند لجوج، کوته فکر، مادی، غیر منطقی و سخت گیر باشد', 'متولدین سال ببر 🐅\n\nغیر قابل پیش\u200cبینی، سرکش، رنگارنگ، قدرتمند، پرشور، جسور، نیرومند، مهیج، صادق، مهربان، نوع دوست، بخشنده و سخاوتمند. متولدین این سال گاهی بی قرار، بی پروا، بی تاب، تند مزاج، کله شق، خودخواه، پرخاشگر و دمدمی مزاج هستند.', 'متولدین سال خرگوش 🐇\n\nبخشنده، بهترین دوست، مهربان، حساس، دارای صدای نرم و ملایم، شیرین، زیبا، کم حرف، محتاط و هوشیار، هنرمند، بسیار دقیق، زودرنج، خودسر، خجالتی، دانا، دلسوز، خوش شانس و قابل انعطاف. متولدین این سال گاهی دمدمی مزاج، منزوی، ظاهر بین، خودپسند، فرصت طلب و لجوج هستند.', 'متولدین سال اژدها 🐲\n\nسخاوتمند، با وقار، نیرومند، قوی، مطمئن به خود، مغرور، خوش ذات، صریح، موقر، حسود، غیر عادی، خردمند، آتشین مزاج، پرشور، قاطع، پیش گام، هنرمند، بخشنده و وفادار. متولدین این سال گاهی موقع نشناس، گستاخ، متکبر، ظالم، سخت گیر، بی گذشت، متعصب، خشن، تند رو و بی حیا هستند.', 'متولدین سال مار 🐍\n\n متفکر، عاقل، عارف، ظریف، دارایی صدای نرم و ملایم، هوسران، خلاق، محتاط، زیرک، زیبا، هوشیار، مسئول، خونسرد، قوی، ثابت قدم و هدفمند. متولدین سال مار گاهی منزوی، ضعیف در برقراری روابط اجتماعی، دارای حس مالکیت شدید، مردد، بی اعتقاد، دروغگو، خاموش و سرد هستند.', 'متولدین سال اسب 🐎\n\nشاد، محبوب، تیز هوش، قابل تغییر، خاکی، حساس و باهوش، پر حرف، هم از لحاظ جسمی و هم فکری فرز و سریع، جذاب، هوشمند، دانا، قابل انعظاف و روشن فکر. متولدین این سال ممکن است گاهی بی ثبات، مکتبر، مضطرب، بی ادب، ساده لوح و گستاخ می شوند.', 'متولدین سال قوچ ، بز ( گوسفند ) 🐐🐑🐏\n\nنیکوکار و عادل، دلسوز، میانه رو، خجالتی، هنرمند، خلاق، نجیب، مهربان، فهمیده، مصمم، صلح جو، دست و دل باز و به دنبال امنیت و آرامش. این افراد گاهی دمدمی مزاج، دو دل، بیش فعال و نگران هستند')
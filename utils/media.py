@@ -0,0 +1,157 @@
+import os
+import glob
+import asyncio
+import hashlib
+import datetime
+from sqlmodel import Session, select
+from telebot.asyncio_helper import ApiTelegramException
+from utils.database import run_db
+from models import MediaAsset
+
+
+
+MEDIA_DIR = "data"
+MEDIA_PATTERNS = ["img/*", "اطلاعیه_مهم.mp4"]
+
+# Bot method (send_<kind>) and argument name per file extension.
+MEDIA_KINDS = {
+    ".png": "photo",
+    ".jpg": "photo",
+    ".jpeg": "photo",
+    ".mp4": "video",
+    ".m4a": "audio",
+    ".mp3": "audio",
+}
+
+# Parts of the error description Telegram returns for a file id it no
+# longer accepts. Other 400s (blocked bot, unknown chat) are the chat's.
+STALE_FILE_ID_ERRORS = [
+    "wrong file identifier",
+    "wrong remote file identifier",
+    "file reference expired",
+    "file_reference_expired",
+]
+
+
+def is_stale_file_id_error(e):
+    description = (e.description or "").lower()
+    return e.error_code == 400 and any(error in description for error in STALE_FILE_ID_ERRORS)
+
+
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def uploaded_file_id(message, kind):
+    media = getattr(message, kind)
+    # Photos come back in several sizes, the last one is the original.
+    if isinstance(media, list):
+        media = media[-1]
+    return media.file_id
+
+
+class MediaRegistry:
+    """Sends files under MEDIA_DIR by Telegram file_id, uploading each one once.
+
+    File ids are stored with the file's hash, so a changed file is uploaded
+    again. Files are checked by sync() at startup.
+    """
+
+    def __init__(self, media_dir=MEDIA_DIR, patterns=MEDIA_PATTERNS):
+        self.media_dir = media_dir
+        self.patterns = patterns
+        self._file_ids = {}
+        self._locks = {}
+
+    def paths(self):
+        paths = []
+        for pattern in self.patterns:
+            for file_path in sorted(glob.glob(os.path.join(self.media_dir, pattern))):
+                if os.path.splitext(file_path)[1].lower() in MEDIA_KINDS:
+                    paths.append(os.path.relpath(file_path, self.media_dir))
+        return paths
+
+    def sync(self, engine):
+        """Hash new or modified files and load the file ids still valid."""
+        with Session(engine) as session:
+            for path in self.paths():
+                stat = os.stat(os.path.join(self.media_dir, path))
+                asset = session.get(MediaAsset, path)
+                if asset is None or asset.size != stat.st_size or asset.mtime_ns != stat.st_mtime_ns:
+                    sha256 = file_sha256(os.path.join(self.media_dir, path))
+                    if asset is None:
+                        asset = MediaAsset(path=path, sha256=sha256, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+                    elif asset.sha256 != sha256:
+                        print("Media file changed:", path)
+                        asset.sha256 = sha256
+                        asset.file_id = None
+                    asset.size = stat.st_size
+                    asset.mtime_ns = stat.st_mtime_ns
+                    asset.update_date = datetime.datetime.now(datetime.timezone.utc)
+                    session.add(asset)
+                if asset.file_id:
+                    self._file_ids[path] = asset.file_id
+            session.commit()
+        print(f"Media registry: {len(self._file_ids)} cached file ids")
+
+    def load(self, engine):
+        """Load the stored file ids without checking the files, for workers started after sync()."""
+        with Session(engine) as session:
+            assets = session.exec(
+                select(MediaAsset.path, MediaAsset.file_id).where(MediaAsset.file_id.is_not(None))
+            ).all()
+        self._file_ids.update(dict(assets))
+
+    def set_file_id(self, engine, path, file_id):
+        with Session(engine) as session:
+            asset = session.get(MediaAsset, path)
+            if asset is None:
+                file_path = os.path.join(self.media_dir, path)
+                stat = os.stat(file_path)
+                asset = MediaAsset(
+                    path=path,
+                    sha256=file_sha256(file_path),
+                    size=stat.st_size,
+                    mtime_ns=stat.st_mtime_ns
+                )
+            asset.file_id = file_id
+            asset.update_date = datetime.datetime.now(datetime.timezone.utc)
+            session.add(asset)
+            session.commit()
+
+    async def send(self, bot, engine, chat_id, path, **kwargs):
+        """Send a file under MEDIA_DIR, e.g. path="img/logo.png"."""
+        kind = MEDIA_KINDS[os.path.splitext(path)[1].lower()]
+        send = getattr(bot, f"send_{kind}")
+
+        file_id = self._file_ids.get(path)
+        if file_id:
+            try:
+                return await send(chat_id, **{kind: file_id}, **kwargs)
+            except ApiTelegramException as e:
+                if not is_stale_file_id_error(e):
+                    raise
+                # The file id is no longer accepted, upload the file again.
+                print(f"Media file id rejected for {path}: {e.description}")
+                if self._file_ids.get(path) == file_id:
+                    del self._file_ids[path]
+
+        lock = self._locks.setdefault(path, asyncio.Lock())
+        async with lock:
+            # Another request may have uploaded it while we waited.
+            file_id = self._file_ids.get(path)
+            if file_id:
+                return await send(chat_id, **{kind: file_id}, **kwargs)
+            with open(os.path.join(self.media_dir, path), "rb") as file:
+                message = await send(chat_id, **{kind: file}, **kwargs)
+            file_id = uploaded_file_id(message, kind)
+            self._file_ids[path] = file_id
+            await run_db(self.set_file_id, engine, path, file_id)
+            return message
+
+
+media_registry = MediaRegistry()
@@ -0,0 +1,72 @@
+import time
+import asyncio
+
+
+
+MEMBER_STATUSES = ['member', 'administrator', 'creator']
+
+# Members rarely leave, while non-members are expected to join soon.
+POSITIVE_TTL = 600
+NEGATIVE_TTL = 60
+MAX_ENTRIES = 100_000
+
+
+class MembershipCache:
+    """Caches channel membership per (user_id, channel) with separate TTLs."""
+
+    def __init__(self, positive_ttl=POSITIVE_TTL, negative_ttl=NEGATIVE_TTL, max_entries=MAX_ENTRIES):
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._pending = {}
+
+    def get(self, user_id, channel):
+        entry = self._entries.get((user_id, channel))
+        if entry is None:
+            return None
+        is_member, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[(user_id, channel)]
+            return None
+        return is_member
+
+    def ttl(self, is_member):
+        return self.positive_ttl if is_member else self.negative_ttl
+
+    def set(self, user_id, channel, is_member):
+        if len(self._entries) >= self.max_entries:
+            self._evict()
+        self._entries[(user_id, channel)] = (is_member, time.monotonic() + self.ttl(is_member))
+
+    def invalidate(self, user_id, channels):
+        for channel in channels:
+            self._entries.pop((user_id, channel), None)
+
+    def _evict(self):
+        now = time.monotonic()
+        expired = [key for key, (_, expires_at) in self._entries.items() if expires_at < now]
+        for key in expired:
+            del self._entries[key]
+        # Still full: drop the oldest half, dicts keep insertion order.
+        if len(self._entries) >= self.max_entries:
+            for key in list(self._entries)[:self.max_entries // 2]:
+                del self._entries[key]
+
+    async def fetch(self, user_id, channel, loader):
+        """Return the cached result or load it once, sharing concurrent lookups."""
+        is_member = self.get(user_id, channel)
+        if is_member is not None:
+            return is_member
+        key = (user_id, channel)
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(loader(user_id, channel))
+            self._pending[key] = task
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        is_member = await asyncio.shield(task)
+        self.set(user_id, channel, is_member)
+        return is_member
+
+
+membership_cache = MembershipCache()
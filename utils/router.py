@@ -0,0 +1,33 @@
+class StateRouter:
+    """Routes text messages by the sender's current input state.
+
+    The state is read from a StateStore once per message and the handler is
+    a dict lookup, instead of one filter per handler tried in turn.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.handlers = {}
+
+    def state(self, name):
+        """Register the handler for messages received in the given state."""
+        def decorator(handler):
+            if name in self.handlers:
+                raise ValueError(f"State {name!r} already has a handler")
+            self.handlers[name] = handler
+            return handler
+        return decorator
+
+    def set(self, user_id, name):
+        self.store.set(user_id, name)
+
+    async def clear(self, user_id):
+        await self.store.pop(user_id)
+
+    async def handler_for(self, user_id):
+        return self.handlers.get(await self.store.get(user_id))
+
+    async def dispatch(self, message):
+        handler = await self.handler_for(message.chat.id)
+        if handler is not None:
+            await handler(message)
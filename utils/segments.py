@@ -0,0 +1,247 @@
+import re
+from datetime import datetime, timezone
+from sqlalchemy import text, insert, delete, literal, func
+from sqlmodel import Session, select
+from models import Kua, Zodiac, Fengshui_Score, Stat, Segment, SegmentMember
+from utils.stats import bump
+from utils.assets import CHINESE_SIGNS, CHINESE_SIGNS_FARSI, CHINESE_ELEMENTS, CHINESE_ELEMENTS_FARSI
+
+
+
+# "/send kua=1,3 element=Fire score<40 ..." tokens, in the order segment
+# keys are written.
+SEGMENT_FIELDS = ("kua", "element", "sign", "score")
+SEGMENT_TOKEN = re.compile(r"^(kua|element|sign|score)(<=|>=|=|<|>)(.+)$", re.IGNORECASE)
+KUA_NUMBERS = [str(number) for number in range(1, 10)]
+
+ELEMENT_NAMES = {name.lower(): name for name in CHINESE_ELEMENTS}
+ELEMENT_NAMES.update({farsi: name for name, farsi in CHINESE_ELEMENTS_FARSI.items()})
+SIGN_NAMES = {name.lower(): name for name in CHINESE_SIGNS}
+SIGN_NAMES.update({farsi: name for name, farsi in CHINESE_SIGNS_FARSI.items()})
+
+# One counter per table a segment filter reads, bumped by the triggers
+# below on every write that can change who matches. Cached members are
+# valid while the counters of the segment's tables add up to the same
+# version, so a new user or a new score leaves kua segments alone.
+SEGMENT_TABLES = {
+    "kua": "kua",
+    "element": "zodiac",
+    "sign": "zodiac",
+    "score": "fengshui_score",
+}
+
+# user_id is the rowid of these tables, so each index covers its filter
+# and yields the user ids without touching the table.
+SEGMENT_INDEX_DDL = [
+    "CREATE INDEX IF NOT EXISTS ix_kua_kua_number ON kua(kua_number)",
+    "CREATE INDEX IF NOT EXISTS ix_zodiac_chinese_element ON zodiac(chinese_element)",
+    "CREATE INDEX IF NOT EXISTS ix_zodiac_chinese_sign ON zodiac(chinese_sign)",
+    "CREATE INDEX IF NOT EXISTS ix_fengshui_score_score ON fengshui_score(score)",
+]
+
+
+def version_key(table):
+    return f"segment_version:{table}"
+
+
+def version_trigger(table, name, event, when=None):
+    condition = f" WHEN {when}" if when else ""
+    return (
+        f"CREATE TRIGGER IF NOT EXISTS segment_version_{table}_{name} AFTER {event} ON {table}{condition} BEGIN\n"
+        f"{bump(repr(version_key(table)))}\nEND"
+    )
+
+
+SEGMENT_TRIGGER_DDL = [
+    version_trigger("kua", "ai", "INSERT"),
+    version_trigger("kua", "ad", "DELETE"),
+    # Recalculations rewrite the row, only a changed number matters.
+    version_trigger("kua", "au", "UPDATE OF kua_number", "old.kua_number IS NOT new.kua_number"),
+    version_trigger("zodiac", "ai", "INSERT"),
+    version_trigger("zodiac", "ad", "DELETE"),
+    version_trigger(
+        "zodiac",
+        "au",
+        "UPDATE OF chinese_sign, chinese_element",
+        "old.chinese_sign IS NOT new.chinese_sign OR old.chinese_element IS NOT new.chinese_element"
+    ),
+    version_trigger("fengshui_score", "ai", "INSERT"),
+    version_trigger("fengshui_score", "ad", "DELETE"),
+    version_trigger("fengshui_score", "au", "UPDATE OF score", "old.score IS NOT new.score"),
+]
+
+# Triggers of the single "segment_version" every segment used to share.
+LEGACY_TRIGGERS = [
+    "segment_user_ai", "segment_user_ad",
+    "segment_kua_ai", "segment_kua_ad", "segment_kua_au",
+    "segment_zodiac_ai", "segment_zodiac_ad", "segment_zodiac_au",
+    "segment_fengshui_score_ai", "segment_fengshui_score_ad", "segment_fengshui_score_au",
+]
+
+
+def create_segment_indexes(engine):
+    """Create the segment filter indexes and the version triggers."""
+    with engine.begin() as connection:
+        for statement in SEGMENT_INDEX_DDL + SEGMENT_TRIGGER_DDL:
+            connection.execute(text(statement))
+        legacy = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'segment_user_ai'")
+        ).first()
+        if legacy:
+            for name in LEGACY_TRIGGERS:
+                connection.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+            # Cached versions were counted by the old triggers.
+            connection.execute(delete(SegmentMember))
+            connection.execute(delete(Segment))
+            connection.execute(delete(Stat).where(Stat.key == "segment_version"))
+
+
+# ------------------------------------------------------------------------------
+# Parsing
+# ------------------------------------------------------------------------------
+
+def is_segment_token(token):
+    return SEGMENT_TOKEN.match(token) is not None
+
+
+def parse_score(operator, value):
+    if operator == "=" and "-" in value:
+        low, _, high = value.partition("-")
+        return [(">=", int(low)), ("<=", int(high))]
+    return [(operator, int(value))]
+
+
+def parse_segment(tokens):
+    """Parse "kua=1,3", "element=Fire", "sign=Dragon", "score<40" style tokens.
+
+    Values of one field are alternatives, different fields must all match.
+    Raises ValueError for anything it does not understand.
+    """
+    segment = {}
+    for token in tokens:
+        match = SEGMENT_TOKEN.match(token)
+        if match is None:
+            raise ValueError(f"Unknown segment filter: {token}")
+        field, operator, value = match.group(1).lower(), match.group(2), match.group(3)
+        if field != "score" and operator != "=":
+            raise ValueError(f"{field} only supports '=': {token}")
+        values = [v.strip() for v in value.split(",") if v.strip()]
+        if field == "kua":
+            if any(v not in KUA_NUMBERS for v in values):
+                raise ValueError(f"Kua numbers are 1 to 9: {token}")
+        elif field == "element":
+            if any(v.lower() not in ELEMENT_NAMES for v in values):
+                raise ValueError(f"Unknown element: {token}")
+            values = [ELEMENT_NAMES[v.lower()] for v in values]
+        elif field == "sign":
+            if any(v.lower() not in SIGN_NAMES for v in values):
+                raise ValueError(f"Unknown sign: {token}")
+            values = [SIGN_NAMES[v.lower()] for v in values]
+        else:
+            try:
+                values = parse_score(operator, value)
+            except ValueError:
+                raise ValueError(f"Score must be a number or a range like 40-70: {token}")
+        segment.setdefault(field, set()).update(values)
+    return segment
+
+
+def segment_key(segment):
+    """Canonical text of a parsed segment, equal segments share cached members."""
+    parts = []
+    for field in SEGMENT_FIELDS:
+        if field not in segment:
+            continue
+        if field == "score":
+            parts += [f"score{operator}{value}" for operator, value in sorted(segment[field])]
+        else:
+            parts.append(f"{field}={','.join(sorted(segment[field]))}")
+    return " ".join(parts)
+
+
+# ------------------------------------------------------------------------------
+# Queries
+# ------------------------------------------------------------------------------
+
+SCORE_OPERATORS = {
+    "<": lambda column, value: column < value,
+    "<=": lambda column, value: column <= value,
+    ">": lambda column, value: column > value,
+    ">=": lambda column, value: column >= value,
+    "=": lambda column, value: column == value,
+}
+
+
+def select_segment_users(segment):
+    """User ids matching every filter of the segment, one indexed lookup per table.
+
+    Only the filtered tables are read, select_broadcast_recipients()
+    drops ids that are no longer in the user table.
+    """
+    lookups = []
+    if "kua" in segment:
+        lookups.append((Kua.user_id, select(Kua.user_id).where(Kua.kua_number.in_(sorted(segment["kua"])))))
+    zodiac = []
+    if "element" in segment:
+        zodiac.append(Zodiac.chinese_element.in_(sorted(segment["element"])))
+    if "sign" in segment:
+        zodiac.append(Zodiac.chinese_sign.in_(sorted(segment["sign"])))
+    if zodiac:
+        lookups.append((Zodiac.user_id, select(Zodiac.user_id).where(*zodiac)))
+    if "score" in segment:
+        lookups.append((Fengshui_Score.user_id, select(Fengshui_Score.user_id).where(*(
+            SCORE_OPERATORS[operator](Fengshui_Score.score, value)
+            for operator, value in sorted(segment["score"])
+        ))))
+    column, statement = lookups[0]
+    for _, lookup in lookups[1:]:
+        statement = statement.where(column.in_(lookup))
+    return statement
+
+
+def segment_version(session, segment):
+    """Sum of the version counters of the tables the segment reads.
+
+    The counters only grow, so the sum changes whenever one of them does.
+    """
+    keys = sorted({version_key(SEGMENT_TABLES[field]) for field in segment})
+    return session.exec(select(func.coalesce(func.sum(Stat.value), 0)).where(Stat.key.in_(keys))).one()
+
+
+def resolve_segment(engine, segment):
+    """Store the segment's members unless they are still current, return (key, total).
+
+    Members are rebuilt only after a write changed the kua numbers, zodiac
+    signs or scores the segment filters on, repeated broadcasts to a
+    segment reuse them.
+    """
+    key = segment_key(segment)
+    with Session(engine) as session:
+        cached = session.get(Segment, key)
+        if cached and cached.version == segment_version(session, segment):
+            return key, cached.total
+
+    with Session(engine) as session:
+        # Writing first takes the write lock, so the version read next
+        # cannot change before the members are stored.
+        session.exec(delete(SegmentMember).where(SegmentMember.segment == key))
+        version = segment_version(session, segment)
+        members = select_segment_users(segment).subquery()
+        session.exec(insert(SegmentMember).from_select(
+            ["segment", "user_id"],
+            select(literal(key), members.c.user_id)
+        ))
+        total = session.exec(
+            select(func.count()).where(SegmentMember.segment == key)
+        ).one()
+        cached = session.get(Segment, key) or Segment(key=key)
+        cached.version = version
+        cached.total = total
+        cached.update_date = datetime.now(timezone.utc)
+        session.add(cached)
+        session.commit()
+    return key, total
+
+
+def select_segment_members(key):
+    return select(SegmentMember.user_id).where(SegmentMember.segment == key)
@@ -0,0 +1,208 @@
+import json
+import time
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from sqlmodel import Session, select, delete
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import ConversationState
+
+
+
+# Abandoned flows are dropped after this long unless a store sets its own TTL.
+DEFAULT_TTL = 24 * 60 * 60
+MAX_ENTRIES = 10_000
+
+
+class MemoryStateBackend:
+    """Keeps nothing beyond the store's own memory, state is lost on restart."""
+
+    persistent = False
+
+    def load(self, namespace, key):
+        return None
+
+    async def fetch(self, namespace, key):
+        return None
+
+    def load_namespace(self, namespace, now, limit):
+        return []
+
+    def save(self, namespace, key, data, expires_at):
+        pass
+
+    def delete(self, namespace, key):
+        pass
+
+    def purge_expired(self, now):
+        return 0
+
+    def close(self):
+        pass
+
+
+class SqliteStateBackend:
+    """Persists entries in the conversationstate table.
+
+    Writes go through one dedicated thread, so they apply in the order they
+    were made without holding up the event loop. fetch() reads on the same
+    thread, so it sees every write queued before it.
+    """
+
+    persistent = True
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state")
+
+    def load(self, namespace, key):
+        with Session(self.engine) as session:
+            entry = session.get(ConversationState, (namespace, key))
+            if entry is None:
+                return None
+            return entry.data, entry.expires_at
+
+    async def fetch(self, namespace, key):
+        return await asyncio.wrap_future(self.executor.submit(self.load, namespace, key))
+
+    def load_namespace(self, namespace, now, limit):
+        with Session(self.engine) as session:
+            return session.exec(
+                select(ConversationState.key, ConversationState.data, ConversationState.expires_at)
+                .where(ConversationState.namespace == namespace, ConversationState.expires_at > now)
+                .order_by(ConversationState.expires_at.desc())
+                .limit(limit)
+            ).all()
+
+    def _save(self, namespace, key, data, expires_at):
+        statement = sqlite_insert(ConversationState).values(
+            namespace=namespace, key=key, data=data, expires_at=expires_at
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=["namespace", "key"],
+            set_={"data": statement.excluded.data, "expires_at": statement.excluded.expires_at}
+        )
+        with Session(self.engine) as session:
+            session.exec(statement)
+            session.commit()
+
+    def _delete(self, namespace, key):
+        with Session(self.engine) as session:
+            session.exec(
+                delete(ConversationState).where(
+                    ConversationState.namespace == namespace, ConversationState.key == key
+                )
+            )
+            session.commit()
+
+    def save(self, namespace, key, data, expires_at):
+        self.executor.submit(self._save, namespace, key, data, expires_at)
+
+    def delete(self, namespace, key):
+        self.executor.submit(self._delete, namespace, key)
+
+    def purge_expired(self, now):
+        with Session(self.engine) as session:
+            result = session.exec(delete(ConversationState).where(ConversationState.expires_at <= now))
+            session.commit()
+            return result.rowcount
+
+    def close(self):
+        """Wait for queued writes."""
+        self.executor.shutdown(wait=True)
+
+
+class StateStore:
+    """Per-user conversation state with a TTL per entry and LRU eviction.
+
+    Entries live in memory, bounded by max_entries, and are written through
+    to the backend. A miss only reads the backend once memory no longer
+    holds everything the backend does, i.e. after an eviction, and does so
+    off the event loop, which is why get, update and pop are coroutines.
+    """
+
+    def __init__(self, namespace, backend, ttl=DEFAULT_TTL, max_entries=MAX_ENTRIES):
+        self.namespace = namespace
+        self.backend = backend
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._complete = not backend.persistent
+        self.evictions = 0
+
+    def load(self):
+        """Warm memory from the backend, call once at startup."""
+        rows = self.backend.load_namespace(self.namespace, time.time(), self.max_entries + 1)
+        for key, data, expires_at in reversed(rows[:self.max_entries]):
+            self._entries[key] = (json.loads(data), expires_at)
+        self._complete = len(rows) <= self.max_entries
+        return len(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def _entry(self, key):
+        entry = self._entries.get(key)
+        if entry is None and not self._complete:
+            stored = await self.backend.fetch(self.namespace, key)
+            # A set() while the backend was read wins over the stored value.
+            entry = self._entries.get(key)
+            if entry is None and stored is not None:
+                data, expires_at = stored
+                entry = (json.loads(data), expires_at)
+                self._remember(key, entry)
+        return entry
+
+    async def get(self, key, default=None):
+        entry = await self._entry(key)
+        if entry is None:
+            return default
+        value, expires_at = entry
+        if expires_at <= time.time():
+            self._entries.pop(key, None)
+            self.backend.delete(self.namespace, key)
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + (ttl or self.ttl)
+        self._remember(key, (value, expires_at))
+        self.backend.save(
+            self.namespace,
+            key,
+            json.dumps(value, ensure_ascii=False, separators=(",", ":")),
+            expires_at
+        )
+        return value
+
+    async def update(self, key, **fields):
+        """Merge fields into a dict entry (or start one) and save it."""
+        value = dict(await self.get(key) or {})
+        value.update(fields)
+        return self.set(key, value)
+
+    async def pop(self, key, default=None):
+        entry = await self._entry(key)
+        self._entries.pop(key, None)
+        self.backend.delete(self.namespace, key)
+        if entry is None or entry[1] <= time.time():
+            return default
+        return entry[0]
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._evict()
+
+    def _evict(self):
+        now = time.time()
+        expired = [key for key, (_, expires_at) in self._entries.items() if expires_at <= now]
+        for key in expired:
+            del self._entries[key]
+        # Least recently used first, they are still in the backend if persistent.
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+            self._complete = False
@@ -0,0 +1,126 @@
+from sqlalchemy import text, or_
+from sqlmodel import Session, select
+from models import Stat
+
+
+
+# Fengshui score bands, as explained to the user with the result.
+SCORE_BAND = "CASE WHEN {0} < 40 THEN 'low' WHEN {0} <= 70 THEN 'mid' ELSE 'high' END"
+CITY_KEY = "'city:' || lower(trim(coalesce({0}, '')))"
+
+
+def bump(key, delta="1"):
+    return (
+        f"INSERT INTO stat(key, value) VALUES ({key}, {delta}) "
+        "ON CONFLICT(key) DO UPDATE SET value = value + excluded.value;"
+    )
+
+
+def trigger(name, event, body):
+    return f"CREATE TRIGGER IF NOT EXISTS stat_{name} AFTER {event} BEGIN\n{body}\nEND"
+
+
+# Counters are kept by triggers, so every write path updates them in the
+# same transaction as the row itself.
+STATS_DDL = [
+    trigger("user_ai", 'INSERT ON "user"', "\n".join([
+        bump("'users'"),
+        bump(CITY_KEY.format("new.city")),
+    ])),
+    trigger("user_ad", 'DELETE ON "user"', "\n".join([
+        bump("'users'", "-1"),
+        bump(CITY_KEY.format("old.city"), "-1"),
+    ])),
+    trigger("user_au", 'UPDATE OF city ON "user"', "\n".join([
+        bump(CITY_KEY.format("old.city"), "-1"),
+        bump(CITY_KEY.format("new.city")),
+    ])),
+    # count_visit is updated once per counted calculation, whether it goes
+    # up or restarts at 1 in a new quota period.
+    trigger("kua_ai", "INSERT ON kua", bump("'kua_calculations'")),
+    trigger("kua_au", "UPDATE OF count_visit ON kua", bump("'kua_calculations'")),
+    trigger("zodiac_ai", "INSERT ON zodiac", bump("'zodiac_calculations'")),
+    trigger("zodiac_au", "UPDATE OF count_visit ON zodiac", bump("'zodiac_calculations'")),
+    trigger("fengshui_score_ai", "INSERT ON fengshui_score", "\n".join([
+        bump("'fengshui_scores'"),
+        bump("'fengshui_score_sum'", "coalesce(new.score, 0)"),
+        bump("'fengshui_score:' || " + SCORE_BAND.format("new.score")),
+    ])),
+    trigger("fengshui_score_au", "UPDATE OF score ON fengshui_score", "\n".join([
+        bump("'fengshui_score_sum'", "coalesce(new.score, 0) - coalesce(old.score, 0)"),
+        bump("'fengshui_score:' || " + SCORE_BAND.format("old.score"), "-1"),
+        bump("'fengshui_score:' || " + SCORE_BAND.format("new.score")),
+    ])),
+]
+
+
+# Counters rebuilt below. Other rows of the stat table (e.g. the segment
+# versions) are not derived from the tables and are left alone.
+STATS_KEYS = "key IN ('users', 'kua_calculations', 'zodiac_calculations', 'fengshui_scores', " \
+    "'fengshui_score_sum') OR key LIKE 'city:%' OR key LIKE 'fengshui_score:%'"
+
+# Aggregate queries the counters are rebuilt from.
+STATS_REBUILD = [
+    f"DELETE FROM stat WHERE {STATS_KEYS}",
+    'INSERT INTO stat(key, value) SELECT \'users\', count(*) FROM "user"',
+    f'INSERT INTO stat(key, value) SELECT {CITY_KEY.format("city")}, count(*) FROM "user" GROUP BY 1',
+    "INSERT INTO stat(key, value) SELECT 'kua_calculations', coalesce(sum(calculations), 0) FROM kua",
+    "INSERT INTO stat(key, value) SELECT 'zodiac_calculations', coalesce(sum(calculations), 0) FROM zodiac",
+    "INSERT INTO stat(key, value) SELECT 'fengshui_scores', count(*) FROM fengshui_score",
+    "INSERT INTO stat(key, value) SELECT 'fengshui_score_sum', coalesce(sum(score), 0) FROM fengshui_score",
+    "INSERT INTO stat(key, value) SELECT 'fengshui_score:' || "
+    f"{SCORE_BAND.format('score')}, count(*) FROM fengshui_score GROUP BY 1",
+]
+
+
+# Rows written before the calculations column existed only know the
+# count_visit of their last quota period, the closest value there is.
+CALCULATIONS_BACKFILL = [
+    "UPDATE kua SET calculations = count_visit WHERE calculations = 0 AND count_visit > 0",
+    "UPDATE zodiac SET calculations = count_visit WHERE calculations = 0 AND count_visit > 0",
+]
+
+
+def create_stats_triggers(engine):
+    """Install the counter triggers, seeding the counters on first run."""
+    with engine.begin() as connection:
+        for statement in CALCULATIONS_BACKFILL:
+            connection.execute(text(statement))
+        exists = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'stat_%'")
+        ).first()
+        for statement in STATS_DDL:
+            connection.execute(text(statement))
+        if not exists:
+            print("Building stats counters ...")
+            for statement in STATS_REBUILD:
+                connection.execute(text(statement))
+
+
+def rebuild_stats(engine):
+    with engine.begin() as connection:
+        for statement in STATS_REBUILD:
+            connection.execute(text(statement))
+
+
+def get_stat(engine, key):
+    with Session(engine) as session:
+        stat = session.get(Stat, key)
+        return stat.value if stat else 0
+
+
+def get_stats(engine, top_cities=10):
+    with Session(engine) as session:
+        # "city;" sorts right after every "city:..." key, so both reads
+        # are primary-key range scans.
+        stats = dict(session.exec(
+            select(Stat.key, Stat.value).where(or_(Stat.key < "city:", Stat.key >= "city;"))
+        ).all())
+        cities = session.exec(
+            select(Stat.key, Stat.value)
+            .where(Stat.key >= "city:", Stat.key < "city;", Stat.value > 0)
+            .order_by(Stat.value.desc())
+            .limit(top_cities)
+        ).all()
+    stats["cities"] = [(key[len("city:"):], value) for key, value in cities]
+    return stats
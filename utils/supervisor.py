@@ -0,0 +1,163 @@
+import json
+import time
+import zlib
+import signal
+import asyncio
+import multiprocessing
+from telebot import asyncio_helper
+from telebot.types import Update
+
+
+
+# How long a worker gets to finish its queued updates on shutdown.
+WORKER_DRAIN_TIMEOUT = 60
+# How often dead workers are looked for.
+WORKER_CHECK_INTERVAL = 5
+POLLING_TIMEOUT = 20
+
+
+def payload_key(payload):
+    """Raw update counterpart of utils.executor.update_key."""
+    for kind in ("message", "edited_message"):
+        if kind in payload:
+            return payload[kind]["chat"]["id"]
+    if "callback_query" in payload:
+        call = payload["callback_query"]
+        if "message" in call:
+            return call["message"]["chat"]["id"]
+        return call["from"]["id"]
+    if "chat_member" in payload:
+        return payload["chat_member"]["new_chat_member"]["user"]["id"]
+    if "my_chat_member" in payload:
+        return payload["my_chat_member"]["chat"]["id"]
+    return payload.get("update_id", 0)
+
+
+def shard_for(payload, workers):
+    return zlib.crc32(str(payload_key(payload)).encode()) % workers
+
+
+class Supervisor:
+    """Starts worker processes and hands each update to the one owning its chat.
+
+    Every chat always lands on the same worker, so its updates stay ordered
+    and its conversation state stays in one process's memory. Workers share
+    the database, including the SQLite state backend, so a restarted or
+    resized pool picks up where the old one stopped. watch() replaces a
+    worker that died with a new one on the same queue, so its chats only
+    wait for the restart.
+    """
+
+    def __init__(self, worker_target, workers):
+        self.context = multiprocessing.get_context("spawn")
+        self.worker_target = worker_target
+        self.queues = [self.context.Queue() for _ in range(workers)]
+        self.processes = [None] * workers
+        self.stopping = False
+
+    def _spawn(self, index):
+        process = self.context.Process(
+            target=self.worker_target,
+            args=(index, self.queues[index]),
+            name=f"worker-{index}"
+        )
+        process.start()
+        self.processes[index] = process
+
+    def start(self):
+        for index in range(len(self.queues)):
+            self._spawn(index)
+        print(f"Started {len(self.processes)} workers")
+
+    def restart_dead(self):
+        """Respawn workers that exited, return how many were replaced."""
+        restarted = 0
+        for index, process in enumerate(self.processes):
+            if self.stopping:
+                break
+            if not process.is_alive():
+                print(f"{process.name} exited with code {process.exitcode}, restarting")
+                process.join()
+                self._spawn(index)
+                restarted += 1
+        return restarted
+
+    async def watch(self, interval=WORKER_CHECK_INTERVAL):
+        while not self.stopping:
+            await asyncio.sleep(interval)
+            self.restart_dead()
+
+    def dispatch(self, payload):
+        self.queues[shard_for(payload, len(self.queues))].put(json.dumps(payload))
+
+    def stop(self, timeout=WORKER_DRAIN_TIMEOUT):
+        """Let every worker finish its queue, then stop the stragglers."""
+        self.stopping = True
+        for queue in self.queues:
+            queue.put(None)
+        # Workers drain in parallel, so they share one deadline.
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                print(f"{process.name} did not drain in {timeout}s, terminating")
+                process.terminate()
+                process.join()
+        print("Workers stopped")
+
+
+async def run_polling_supervisor(bot, dispatch, allowed_updates=None):
+    """Long-poll Telegram and pass each raw update to dispatch until SIGINT/SIGTERM."""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    stop = asyncio.create_task(stop_event.wait())
+
+    offset = None
+    while not stop_event.is_set():
+        poll = asyncio.create_task(asyncio_helper.get_updates(
+            bot.token,
+            offset=offset,
+            timeout=POLLING_TIMEOUT,
+            allowed_updates=allowed_updates,
+            request_timeout=POLLING_TIMEOUT + 10
+        ))
+        await asyncio.wait([poll, stop], return_when=asyncio.FIRST_COMPLETED)
+        if not poll.done():
+            # Updates not fetched yet are delivered again on the next start.
+            poll.cancel()
+            break
+        try:
+            updates = poll.result()
+        except Exception as e:
+            print(f"Error getting updates: {e}")
+            await asyncio.sleep(3)
+            continue
+        for payload in updates:
+            dispatch(payload)
+            offset = payload["update_id"] + 1
+
+    # Acknowledge the last dispatched update so it is not delivered again.
+    if offset is not None:
+        try:
+            await asyncio_helper.get_updates(bot.token, offset=offset, limit=1, timeout=0)
+        except Exception as e:
+            print(f"Error acknowledging updates: {e}")
+
+
+def ignore_shutdown_signals():
+    """Workers drain on the supervisor's signal instead of dying with the process group."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+
+async def run_worker(bot, queue):
+    """Handle updates from the supervisor until it sends None."""
+    loop = asyncio.get_running_loop()
+    while True:
+        raw = await loop.run_in_executor(None, queue.get)
+        if raw is None:
+            break
+        bot.update_executor.submit(Update.de_json(raw))
+    await bot.update_executor.join()
@@ -0,0 +1,106 @@
+import json
+import signal
+import asyncio
+from aiohttp import web
+from telebot.types import Update
+
+
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def create_webhook_app(bot, path, secret_token=None, allowed_updates=None, dispatch=None):
+    """Build the aiohttp app that receives Telegram updates on `path`.
+
+    With `dispatch`, each raw update is handed to it instead of the bot's
+    handlers, e.g. to forward it to a worker process.
+    """
+    app = web.Application()
+    app["tasks"] = set()
+
+    async def handle_update(request):
+        if secret_token and request.headers.get(SECRET_TOKEN_HEADER) != secret_token:
+            return web.Response(status=403)
+        try:
+            payload = json.loads(await request.text())
+        except ValueError:
+            return web.Response(status=400)
+
+        # Telegram already filters by allowed_updates, but a misconfigured
+        # webhook or a stale subscription must not reach the handlers.
+        if allowed_updates and not any(kind in payload for kind in allowed_updates):
+            return web.Response()
+
+        if dispatch is not None:
+            dispatch(payload)
+            return web.Response()
+
+        # Answer Telegram right away and let the handlers run on their own.
+        task = asyncio.create_task(
+            bot.process_new_updates([Update.de_json(payload)])
+        )
+        app["tasks"].add(task)
+        task.add_done_callback(app["tasks"].discard)
+        return web.Response()
+
+    async def drain_updates(app):
+        if app["tasks"]:
+            await asyncio.gather(*app["tasks"], return_exceptions=True)
+
+    app.router.add_post(path, handle_update)
+    app.on_shutdown.append(drain_updates)
+    return app
+
+
+async def run_webhook(
+    bot,
+    url,
+    path="/webhook",
+    host="0.0.0.0",
+    port=8080,
+    secret_token=None,
+    allowed_updates=None,
+    drop_pending_updates=False,
+    dispatch=None,
+    remove_on_shutdown=False,
+):
+    """Serve the webhook until SIGINT/SIGTERM.
+
+    The webhook is left registered on shutdown, so an instance stopping
+    during a rolling deploy does not unregister its replacement. Pass
+    remove_on_shutdown=True to delete it anyway.
+    """
+    app = create_webhook_app(
+        bot=bot,
+        path=path,
+        secret_token=secret_token,
+        allowed_updates=allowed_updates,
+        dispatch=dispatch
+    )
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+
+    await bot.set_webhook(
+        url=f"{url.rstrip('/')}{path}",
+        secret_token=secret_token,
+        allowed_updates=allowed_updates,
+        drop_pending_updates=drop_pending_updates
+    )
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    print(f"Webhook is listening on {host}:{port}{path} ...")
+    try:
+        await stop_event.wait()
+    finally:
+        print("Shutting down webhook ...")
+        if remove_on_shutdown:
+            await bot.remove_webhook()
+        # Stops accepting requests and waits for in-flight updates.
+        await runner.cleanup()
+        await bot.close_session()
@@ -0,0 +1,126 @@
+import asyncio
+from sqlmodel import Session
+from utils.database import run_db
+
+
+
+# A batch is committed once it holds MAX_BATCH writes or the first write
+# has waited MAX_DELAY seconds, whichever comes first.
+MAX_BATCH = 200
+MAX_DELAY = 0.005
+
+
+class WriteBehindBuffer:
+    """Group-commits small writes from a single writer task.
+
+    submit(write, key=..., **kwargs) queues write(session=..., **kwargs) and
+    returns a future with its result. Writes queued within MAX_DELAY of each
+    other share one transaction, i.e. one fsync. Use read(key, ...) to read
+    after your own writes: it waits for the key's queued writes first.
+    Writes nobody awaits go through submit_background(), which logs failures.
+    """
+
+    def __init__(self, engine, max_batch=MAX_BATCH, max_delay=MAX_DELAY):
+        self.engine = engine
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = None
+        self._writer = None
+        self._pending = {}
+        self._closed = False
+
+    def submit(self, write, key=None, **kwargs):
+        if self._closed:
+            raise RuntimeError("Write buffer is closed")
+        if self._writer is None:
+            self._queue = asyncio.Queue()
+            self._writer = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        if key is not None:
+            pending = self._pending.setdefault(key, set())
+            pending.add(future)
+            future.add_done_callback(lambda _: self._forget(key, future))
+        self._queue.put_nowait((write, kwargs, future))
+        return future
+
+    def submit_background(self, write, key=None, **kwargs):
+        """submit() for writes nobody awaits, a failure is logged instead of raised."""
+        future = self.submit(write, key=key, **kwargs)
+        future.add_done_callback(self._log_failure)
+        return future
+
+    async def settle(self, key):
+        """Wait until every write queued for key is committed (or failed)."""
+        pending = self._pending.get(key)
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def read(self, key, func, *args, **kwargs):
+        """run_db(func, ...) after the key's queued writes are committed."""
+        await self.settle(key)
+        return await run_db(func, *args, **kwargs)
+
+    async def close(self):
+        """Commit everything queued and stop the writer."""
+        self._closed = True
+        if self._writer is not None:
+            self._queue.put_nowait(None)
+            await self._writer
+
+    def _forget(self, key, future):
+        pending = self._pending.get(key)
+        if pending is not None:
+            pending.discard(future)
+            if not pending:
+                del self._pending[key]
+
+    @staticmethod
+    def _log_failure(future):
+        if not future.cancelled() and future.exception() is not None:
+            print(f"Buffered write failed: {future.exception()}")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            outcomes = await run_db(self._commit, batch)
+            for (_, _, future), (ok, value) in zip(batch, outcomes):
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    def _commit(self, batch):
+        """Run the batch in one transaction, or write by write if that fails."""
+        try:
+            with Session(self.engine) as session:
+                results = [(True, write(session=session, **kwargs)) for write, kwargs, _ in batch]
+                session.commit()
+            return results
+        except Exception as e:
+            if len(batch) == 1:
+                return [(False, e)]
+        # One bad write must not take the others down with it.
+        return [self._commit([item])[0] for item in batch]